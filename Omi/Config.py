@@ -10,18 +10,93 @@ APP_SECRET_KEY = os.getenv("APP_SECRET_KEY")
 
 # OPEN AI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Emails classified per model request
+CLASSIFICATION_BATCH_SIZE = 5
+# Shared limits for every model call made by the process
+LLM_MAX_CONCURRENCY = 8
+LLM_REQUESTS_PER_MINUTE = 500
+LLM_TOKENS_PER_MINUTE = 200000
+LLM_MAX_RETRIES = 5
+# Email body token budgets per task, applied after quoted replies, signatures and boilerplate are removed
+CLASSIFICATION_BODY_TOKENS = 300
+SUMMARIZATION_BODY_TOKENS = 1500
+# Emails summarized per model request, and the prompt tokens such a request may carry
+SUMMARIZATION_BATCH_SIZE = 8
+SUMMARIZATION_BATCH_TOKENS = 8000
+
+# LOCAL CLASSIFIER
+# Confidence needed before an email is answered "not important" without a model call
+LOCAL_CLASSIFIER_THRESHOLD = 0.95
+# Labels needed before a model is trained (per user and category configuration)
+LOCAL_CLASSIFIER_MIN_SAMPLES = 200
+# New labels after which a model is retrained
+LOCAL_CLASSIFIER_RETRAIN_EVERY = 50
+# Share of confident emails still sent to the model to measure agreement
+LOCAL_CLASSIFIER_AUDIT_RATE = 0.05
+# Confident predictions compared with the model before a model may answer on its own
+LOCAL_CLASSIFIER_MIN_COMPARISONS = 50
+# Seconds between two trainings of the same model
+LOCAL_CLASSIFIER_RETRAIN_INTERVAL = 600
+
+# SENDER REPUTATION
+# Classifications remembered per sender address / domain
+SENDER_HISTORY_SIZE = 20
+SENDER_HALF_LIFE_DAYS = 30
+# Decayed number of classifications needed before a sender is trusted
+SENDER_MIN_WEIGHT = 3
+# Share of those classifications that must agree
+SENDER_MIN_AGREEMENT = 0.8
 
 # OMI
 OMI_API_KEY = os.getenv("OMI_API_KEY")
 OMI_APP_ID = os.getenv("OMI_APP_ID")
+# One keep-alive pool shared by every delivery to api.omi.me
+OMI_HTTP_POOL_SIZE = 16
+OMI_CONNECT_TIMEOUT = 5
+OMI_READ_TIMEOUT = 30
+# Requests per minute per (app, user): starts at OMI_RATE_INITIAL, grows by OMI_RATE_INCREASE per healthy
+# response up to OMI_RATE_MAX and halves on every 429, never below OMI_RATE_MIN
+OMI_RATE_INITIAL = 300
+OMI_RATE_MIN = 30
+OMI_RATE_MAX = 1200
+OMI_RATE_INCREASE = 5
+OMI_MAX_RETRIES = 4
 
 # GOOGLE
 REDIRECT_URI = "https://mailmate.omi-wroom.org/gmail-callback"
 GMAIL_SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
+# GMAIL PUSH
+# Pub/Sub topic ("projects/<project>/topics/<topic>") Gmail publishes mailbox changes to; unset keeps interval polling
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC")
+# Shared secret the push subscription appends as ?token= to the /gmail-push endpoint, required with GMAIL_PUSH_TOPIC
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN")
+# Safety poll interval in seconds while push notifications are enabled
+PUSH_SAFETY_INTERVAL = 15 * 60
+
 # FILES
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 
+# CACHE
+EMAIL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+EMAIL_CACHE_TTL = 30 * 24 * 3600
+
+# STREAMING
+STREAM_WINDOW_SIZE = 25
+
+# MEMORY CONVERSION
+# Workers per pipeline stage; emails are fetched by a single cursor-ordered reader
+MEMORY_SUMMARIZE_WORKERS = 4
+MEMORY_DELIVERY_WORKERS = 2
+# Emails (and memories) allowed to wait between two stages before the producing stage blocks
+MEMORY_PIPELINE_QUEUE_SIZE = STREAM_WINDOW_SIZE
+# Conversion passes a background job makes before reporting the emails still missing as partial
+CONVERSION_JOB_ATTEMPTS = 2
+
+# PARSING
+# Decoded bodies are cut at this many characters, prompts only ever use a prefix of the body
+MAX_BODY_CHARS = 20000
+
 # WEBHOOK
 ERROR_RESPONSES = {
     "NO_UID": ("OPS! There is no UID :(", 401),
@@ -31,5 +106,9 @@ ERROR_RESPONSES = {
     "INVALID_DATA": ("Invalid data types", 406),
     "MISSING_UID": ("Missing UID", 407),
     "INVALID_MAIL_COUNT": ("Invalid mail count", 408),
+    "INVALID_PUSH_TOKEN": ("Invalid push token", 409),
+    "PUSH_DISABLED": ("Push notifications are not enabled", 413),
+    "JOB_NOT_FOUND": ("Conversion job not found", 411),
+    "JOB_NOT_RESUMABLE": ("Conversion job is not partial or failed", 412),
     "WENT_WRONG": ("Something went wrong.", 410)
 }
\ No newline at end of file
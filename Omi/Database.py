@@ -1,4 +1,6 @@
 import json
+import time
+import zlib
 import sqlite3
 import threading
 
@@ -17,6 +19,9 @@ class ISQLiteDatabaseManager:
     def execute(self, query: str, params: tuple = ()):
         raise NotImplementedError
 
+    def execute_many(self, query: str, params_list: list):
+        raise NotImplementedError
+
     def fetch_all(self, query: str, params: tuple = ()):
         raise NotImplementedError
 
@@ -29,7 +34,7 @@ class ISQLiteDatabaseManager:
 
 class SQLiteDatabaseManager(ISQLiteDatabaseManager):
     _instance = None
-    _lock = threading.Lock()
+    _lock = threading.RLock()
 
     def __new__(cls, db_path="database.db"):
         with cls._lock:
@@ -45,11 +50,21 @@ class SQLiteDatabaseManager(ISQLiteDatabaseManager):
         self.cursor = self.connection.cursor()
 
     def execute(self, query: str, params: tuple = ()):
-        try:
-            self.cursor.execute(query, params)
-            self.connection.commit()
-        except sqlite3.Error as e:
-            logger.error(f"Database error: {e}")
+        # one shared connection and cursor, so every statement is serialized
+        with self._lock:
+            try:
+                self.cursor.execute(query, params)
+                self.connection.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Database error: {e}")
+
+    def execute_many(self, query: str, params_list: list):
+        with self._lock:
+            try:
+                self.cursor.executemany(query, params_list)
+                self.connection.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Database error: {e}")
 
     def fetch_all(self, query: str, params: tuple = ()):
         with self._lock:
@@ -110,7 +125,8 @@ class UserRepository(IUserRepository):
             mail_check_interval INTEGER DEFAULT 60,
             mail_count INTEGER DEFAULT 3,
             important_categories TEXT DEFAULT '{json.dumps(AIClassificationService.DEFAULT_IMPORTANT_CATEGORIES)}',
-            ignored_categories TEXT DEFAULT '{json.dumps(AIClassificationService.DEFAULT_IGNORED_CATEGORIES)}'
+            ignored_categories TEXT DEFAULT '{json.dumps(AIClassificationService.DEFAULT_IGNORED_CATEGORIES)}',
+            prefilter_rules TEXT DEFAULT '{{}}'
         );
         """
         self.db.execute(query)
@@ -123,6 +139,8 @@ class UserRepository(IUserRepository):
             self.db.execute("ALTER TABLE users ADD COLUMN ignored_categories TEXT DEFAULT '[]'")
         if 'is_logged_in' not in columns:
             self.db.execute("ALTER TABLE users ADD COLUMN is_logged_in INTEGER DEFAULT 1")
+        if 'prefilter_rules' not in columns:
+            self.db.execute("ALTER TABLE users ADD COLUMN prefilter_rules TEXT DEFAULT '{}'")
 
     def add_user(self, uid: str, google_credentials: str = None):
         query = "INSERT INTO users (uid, google_credentials) VALUES (?, ?)"
@@ -193,7 +211,8 @@ class UserRepository(IUserRepository):
                 mail_check_interval,
                 mail_count,
                 important_categories,
-                ignored_categories
+                ignored_categories,
+                prefilter_rules
             FROM users WHERE uid = ?
             """, (uid,)
         )
@@ -202,20 +221,26 @@ class UserRepository(IUserRepository):
             mail_count = result["mail_count"]
             important_categories = result["important_categories"]
             ignored_categories = result["ignored_categories"]
+            prefilter_rules = result["prefilter_rules"]
 
             return {
                 "mail_check_interval": mail_check_interval,
                 "mail_count": mail_count,
                 "important_categories": json.loads(important_categories) if important_categories else AIClassificationService.DEFAULT_IMPORTANT_CATEGORIES,
                 "ignored_categories": json.loads(ignored_categories) if ignored_categories else AIClassificationService.DEFAULT_IGNORED_CATEGORIES,
+                "prefilter_rules": json.loads(prefilter_rules) if prefilter_rules else {},
             }
         return {
             "mail_check_interval": 60,
             "mail_count": 3,
             "important_categories": AIClassificationService.DEFAULT_IMPORTANT_CATEGORIES,
             "ignored_categories": AIClassificationService.DEFAULT_IGNORED_CATEGORIES,
+            "prefilter_rules": {},
         }
 
+    def update_prefilter_rules(self, uid: str, prefilter_rules: dict):
+        self.db.execute("UPDATE users SET prefilter_rules = ? WHERE uid = ?", (json.dumps(prefilter_rules), uid))
+
     def get_mail_check_interval(self, uid: str) -> int:
         result = self.db.fetch_one(
             "SELECT mail_check_interval FROM users WHERE uid = ?", (uid,)
@@ -260,4 +285,662 @@ class MailRepository(IMailRepository):
 
     def is_email_processed(self, uid: str, email_id: str) -> bool:
         query = "SELECT 1 FROM processed_emails WHERE uid = ? AND email_id = ?;"
-        return self.db.fetch_one(query, (uid, email_id)) is not None
\ No newline at end of file
+        return self.db.fetch_one(query, (uid, email_id)) is not None
+
+class ISyncStateRepository(ABC):
+    @abstractmethod
+    def get_history_id(self, uid: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_uid_by_email(self, email_address: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_history_id(self, uid: str, history_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_history_id(self, uid: str):
+        raise NotImplementedError
+
+
+class SyncStateRepository(ISyncStateRepository):
+    def __init__(self, db_manager: ISQLiteDatabaseManager):
+        self.db = db_manager
+        self.create_table()
+        self.add_missing_columns()
+
+    def create_table(self):
+        query = """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            uid TEXT PRIMARY KEY,
+            history_id TEXT,
+            email_address TEXT
+        );
+        """
+        self.db.execute(query)
+
+    def add_missing_columns(self):
+        columns = [row["name"] for row in self.db.fetch_all("PRAGMA table_info(sync_state)")]
+        if 'email_address' not in columns:
+            self.db.execute("ALTER TABLE sync_state ADD COLUMN email_address TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_sync_state_email_address ON sync_state (email_address);")
+
+    def get_history_id(self, uid: str):
+        result = self.db.fetch_one("SELECT history_id FROM sync_state WHERE uid = ?;", (uid,))
+        return result["history_id"] if result else None
+
+    def set_history_id(self, uid: str, history_id: str):
+        query = """
+        INSERT INTO sync_state (uid, history_id) VALUES (?, ?)
+        ON CONFLICT(uid) DO UPDATE SET history_id = excluded.history_id;
+        """
+        self.db.execute(query, (uid, str(history_id)))
+
+    def clear_history_id(self, uid: str):
+        self.db.execute("UPDATE sync_state SET history_id = NULL WHERE uid = ?;", (uid,))
+
+    def set_email_address(self, uid: str, email_address: str):
+        query = """
+        INSERT INTO sync_state (uid, email_address) VALUES (?, ?)
+        ON CONFLICT(uid) DO UPDATE SET email_address = excluded.email_address;
+        """
+        self.db.execute(query, (uid, email_address.lower()))
+
+    def get_uid_by_email(self, email_address: str):
+        result = self.db.fetch_one("SELECT uid FROM sync_state WHERE email_address = ?;", (email_address.lower(),))
+        return result["uid"] if result else None
+
+
+class IEmailCacheRepository(ABC):
+    @abstractmethod
+    def get_many(self, uid: str, message_ids: list) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_many(self, uid: str, emails: list):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_subjects(self, uid: str, message_ids: list) -> dict:
+        raise NotImplementedError
+
+
+class EmailCacheRepository(IEmailCacheRepository):
+    """
+    Parsed emails keyed by (uid, message_id), stored as zlib-compressed JSON, with the subject
+    in its own column so listings don't decompress whole entries.
+    Gmail messages are immutable so entries never go stale; they are only evicted
+    when unused for ttl seconds or when the cache grows past max_bytes (least recently used first).
+    """
+
+    def __init__(self, db_manager: ISQLiteDatabaseManager, max_bytes: int = 256 * 1024 * 1024, ttl: int = 30 * 24 * 3600):
+        self.db = db_manager
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+        self.create_table()
+        self.add_missing_columns()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS email_cache (
+            uid TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_accessed REAL NOT NULL,
+            PRIMARY KEY (uid, message_id)
+        );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_email_cache_last_accessed ON email_cache (last_accessed);")
+
+    def add_missing_columns(self):
+        columns = [row["name"] for row in self.db.fetch_all("PRAGMA table_info(email_cache)")]
+        if 'subject' not in columns:
+            self.db.execute("ALTER TABLE email_cache ADD COLUMN subject TEXT")
+
+    def get_many(self, uid: str, message_ids: list) -> dict:
+        found = {}
+        # stay below SQLite's default limit of 999 bound parameters
+        for start in range(0, len(message_ids), 900):
+            chunk = message_ids[start:start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.fetch_all(
+                f"SELECT message_id, data FROM email_cache WHERE uid = ? AND message_id IN ({placeholders});",
+                (uid, *chunk)
+            ) or []
+            for row in rows:
+                found[row["message_id"]] = json.loads(zlib.decompress(row["data"]))
+
+        if found:
+            now = time.time()
+            self.db.execute_many(
+                "UPDATE email_cache SET last_accessed = ? WHERE uid = ? AND message_id = ?;",
+                [(now, uid, message_id) for message_id in found]
+            )
+
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(set(message_ids)) - len(found)
+
+        return found
+
+    def get(self, uid: str, message_id: str):
+        return self.get_many(uid, [message_id]).get(message_id)
+
+    def get_subjects(self, uid: str, message_ids: list) -> dict:
+        """Subjects of the cached emails among message_ids; entries cached before the subject column are left out."""
+        found = {}
+        for start in range(0, len(message_ids), 900):
+            chunk = message_ids[start:start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.fetch_all(
+                f"SELECT message_id, subject FROM email_cache WHERE uid = ? AND message_id IN ({placeholders}) AND subject IS NOT NULL;",
+                (uid, *chunk)
+            ) or []
+            found.update((row["message_id"], row["subject"]) for row in rows)
+        return found
+
+    def put_many(self, uid: str, emails: list):
+        if not emails:
+            return
+
+        now = time.time()
+        rows = []
+        for email in emails:
+            data = zlib.compress(json.dumps(email).encode("utf-8"))
+            rows.append((uid, email["id"], data, email.get("subject"), len(data), now))
+
+        self.db.execute_many(
+            """
+            INSERT INTO email_cache (uid, message_id, data, subject, size, last_accessed) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(uid, message_id) DO UPDATE SET data = excluded.data, subject = excluded.subject,
+                size = excluded.size, last_accessed = excluded.last_accessed;
+            """,
+            rows
+        )
+        self.evict()
+
+    def evict(self):
+        expired = self.db.fetch_one(
+            "SELECT COUNT(*) AS count FROM email_cache WHERE last_accessed < ?;", (time.time() - self.ttl,)
+        )
+        evicted = expired["count"] if expired else 0
+        if evicted:
+            self.db.execute("DELETE FROM email_cache WHERE last_accessed < ?;", (time.time() - self.ttl,))
+
+        total = self.db.fetch_one("SELECT COALESCE(SUM(size), 0) AS total FROM email_cache;")
+        total = total["total"] if total else 0
+        if total > self.max_bytes:
+            # shrink to 90% so the next few inserts don't trigger another eviction pass
+            overflow = total - int(self.max_bytes * 0.9)
+            rows = self.db.fetch_all(
+                "SELECT uid, message_id, size FROM email_cache ORDER BY last_accessed ASC;"
+            ) or []
+            victims = []
+            for row in rows:
+                if overflow <= 0:
+                    break
+                victims.append((row["uid"], row["message_id"]))
+                overflow -= row["size"]
+            self.db.execute_many("DELETE FROM email_cache WHERE uid = ? AND message_id = ?;", victims)
+            evicted += len(victims)
+
+        if evicted:
+            with self._stats_lock:
+                self.evictions += evicted
+
+    def stats(self) -> dict:
+        total = self.db.fetch_one("SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM email_cache;")
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": total["entries"] if total else 0,
+                "bytes": total["bytes"] if total else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class IClassificationCacheRepository(ABC):
+    @abstractmethod
+    def get_many(self, keys: list) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_many(self, results: dict):
+        raise NotImplementedError
+
+
+class ClassificationCacheRepository(IClassificationCacheRepository):
+    """
+    Classification results keyed by the category configuration and a hash of the exact prompt text,
+    either per user or, without the per-user fields, shared by every user who receives the same email.
+    Entries expire after ttl seconds; past max_entries the least recently used go first.
+    """
+
+    def __init__(self, db_manager: ISQLiteDatabaseManager, max_entries: int = 50000, ttl: int = 7 * 24 * 3600):
+        self.db = db_manager
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self.create_table()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            cache_key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_accessed REAL NOT NULL
+        );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_classification_cache_last_accessed ON classification_cache (last_accessed);")
+
+    def get_many(self, keys: list) -> dict:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        oldest = time.time() - self.ttl
+        for start in range(0, len(keys), 900):
+            chunk = keys[start:start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.fetch_all(
+                f"SELECT cache_key, result FROM classification_cache WHERE created_at >= ? AND cache_key IN ({placeholders});",
+                (oldest, *chunk)
+            ) or []
+            for row in rows:
+                found[row["cache_key"]] = json.loads(row["result"])
+
+        if found:
+            now = time.time()
+            self.db.execute_many(
+                "UPDATE classification_cache SET last_accessed = ? WHERE cache_key = ?;",
+                [(now, key) for key in found]
+            )
+
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def put_many(self, results: dict):
+        if not results:
+            return
+
+        now = time.time()
+        self.db.execute_many(
+            """
+            INSERT INTO classification_cache (cache_key, result, created_at, last_accessed) VALUES (?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET result = excluded.result, created_at = excluded.created_at, last_accessed = excluded.last_accessed;
+            """,
+            [(key, json.dumps(result), now, now) for key, result in results.items()]
+        )
+        self.evict()
+
+    def evict(self):
+        self.db.execute("DELETE FROM classification_cache WHERE created_at < ?;", (time.time() - self.ttl,))
+
+        count = self.db.fetch_one("SELECT COUNT(*) AS count FROM classification_cache;")
+        count = count["count"] if count else 0
+        if count > self.max_entries:
+            # shrink to 90% so the next few inserts don't trigger another eviction pass
+            self.db.execute(
+                """
+                DELETE FROM classification_cache WHERE cache_key IN (
+                    SELECT cache_key FROM classification_cache ORDER BY last_accessed ASC LIMIT ?
+                );
+                """,
+                (count - int(self.max_entries * 0.9),)
+            )
+
+    def stats(self) -> dict:
+        total = self.db.fetch_one("SELECT COUNT(*) AS entries FROM classification_cache;")
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": total["entries"] if total else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class ITokenUsageRepository(ABC):
+    @abstractmethod
+    def add_usage(self, uid: str, task: str, prompt_tokens: int, completion_tokens: int):
+        raise NotImplementedError
+
+
+class TokenUsageRepository(ITokenUsageRepository):
+    def __init__(self, db_manager: ISQLiteDatabaseManager):
+        self.db = db_manager
+        self.create_table()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS token_usage (
+            uid TEXT NOT NULL,
+            task TEXT NOT NULL,
+            day TEXT NOT NULL,
+            requests INTEGER DEFAULT 0,
+            prompt_tokens INTEGER DEFAULT 0,
+            completion_tokens INTEGER DEFAULT 0,
+            PRIMARY KEY (uid, task, day)
+        );
+        """)
+
+    def add_usage(self, uid: str, task: str, prompt_tokens: int, completion_tokens: int):
+        self.db.execute(
+            """
+            INSERT INTO token_usage (uid, task, day, requests, prompt_tokens, completion_tokens)
+            VALUES (?, ?, date('now'), 1, ?, ?)
+            ON CONFLICT(uid, task, day) DO UPDATE SET
+                requests = requests + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens;
+            """,
+            (uid, task, prompt_tokens, completion_tokens)
+        )
+
+    def get_usage(self, uid: str = None, since_day: str = None) -> list:
+        query = "SELECT uid, task, SUM(requests) AS requests, SUM(prompt_tokens) AS prompt_tokens, " \
+                "SUM(completion_tokens) AS completion_tokens FROM token_usage WHERE day >= ?"
+        params = [since_day or "0000-00-00"]
+        if uid:
+            query += " AND uid = ?"
+            params.append(uid)
+        query += " GROUP BY uid, task;"
+
+        rows = self.db.fetch_all(query, tuple(params)) or []
+        return [dict(row) for row in rows]
+
+
+class IClassificationLabelRepository(ABC):
+    @abstractmethod
+    def add_labels(self, uid: str, configuration: str, labels: list):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_labels(self, uid: str, configuration: str, limit: int = 5000) -> list:
+        raise NotImplementedError
+
+
+class ClassificationLabelRepository(IClassificationLabelRepository):
+    def __init__(self, db_manager: ISQLiteDatabaseManager):
+        self.db = db_manager
+        self.create_table()
+        self.add_missing_columns()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS classification_labels (
+            uid TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            configuration TEXT,
+            features TEXT NOT NULL,
+            answer INTEGER NOT NULL,
+            important TEXT,
+            ignored TEXT,
+            priority TEXT,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (uid, message_id)
+        );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_classification_labels_created_at ON classification_labels (created_at);")
+
+    def add_missing_columns(self):
+        columns = [row["name"] for row in self.db.fetch_all("PRAGMA table_info(classification_labels)")]
+        if 'configuration' not in columns:
+            self.db.execute("ALTER TABLE classification_labels ADD COLUMN configuration TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_classification_labels_uid_configuration "
+                        "ON classification_labels (uid, configuration, created_at);")
+
+    def add_labels(self, uid: str, configuration: str, labels: list):
+        """labels are (message_id, features, answer, important, ignored, priority) tuples, all made under configuration."""
+        if not labels:
+            return
+
+        now = time.time()
+        self.db.execute_many(
+            """
+            INSERT INTO classification_labels (uid, message_id, configuration, features, answer, important, ignored, priority, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(uid, message_id) DO UPDATE SET
+                configuration = excluded.configuration, features = excluded.features, answer = excluded.answer,
+                important = excluded.important, ignored = excluded.ignored, priority = excluded.priority,
+                created_at = excluded.created_at;
+            """,
+            [(uid, message_id, configuration, features, 1 if answer else 0, important, ignored, priority, now)
+             for message_id, features, answer, important, ignored, priority in labels]
+        )
+
+    def get_labels(self, uid: str, configuration: str, limit: int = 5000) -> list:
+        """Most recent labels of uid made under configuration."""
+        rows = self.db.fetch_all(
+            "SELECT features, answer, important, ignored, priority FROM classification_labels "
+            "WHERE uid = ? AND configuration = ? ORDER BY created_at DESC LIMIT ?;", (uid, configuration, limit)
+        )
+        return rows or []
+
+
+class ISenderReputationRepository(ABC):
+    @abstractmethod
+    def get_histories(self, uid: str) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_histories(self, uid: str, histories: dict):
+        raise NotImplementedError
+
+
+class SenderReputationRepository(ISenderReputationRepository):
+    def __init__(self, db_manager: ISQLiteDatabaseManager):
+        self.db = db_manager
+        self.create_table()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS sender_reputation (
+            uid TEXT NOT NULL,
+            sender_key TEXT NOT NULL,
+            history TEXT NOT NULL,
+            PRIMARY KEY (uid, sender_key)
+        );
+        """)
+
+    def get_histories(self, uid: str) -> dict:
+        """{sender_key: [[timestamp, sender_importance, category, answer], ...]} for every sender of uid."""
+        rows = self.db.fetch_all("SELECT sender_key, history FROM sender_reputation WHERE uid = ?;", (uid,)) or []
+        return {row["sender_key"]: json.loads(row["history"]) for row in rows}
+
+    def save_histories(self, uid: str, histories: dict):
+        if not histories:
+            return
+
+        self.db.execute_many(
+            """
+            INSERT INTO sender_reputation (uid, sender_key, history) VALUES (?, ?, ?)
+            ON CONFLICT(uid, sender_key) DO UPDATE SET history = excluded.history;
+            """,
+            [(uid, key, json.dumps(history)) for key, history in histories.items()]
+        )
+
+
+class IConversionJobRepository(ABC):
+    @abstractmethod
+    def create_job(self, job_id: str, uid: str, mode: str, message_ids: list = None, requested_count: int = None,
+                   force: bool = False):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_job(self, job_id: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_item(self, job_id: str, message_id: str, memory: str = None):
+        raise NotImplementedError
+
+
+class ConversionJobRepository(IConversionJobRepository):
+    """Memory conversion jobs and the emails each one has finished, so an interrupted job can resume."""
+
+    def __init__(self, db_manager: ISQLiteDatabaseManager):
+        self.db = db_manager
+        self.create_table()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS conversion_jobs (
+            job_id TEXT PRIMARY KEY,
+            uid TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            status TEXT NOT NULL,
+            requested_count INTEGER,
+            force INTEGER NOT NULL DEFAULT 0,
+            message_ids TEXT,
+            total INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        """)
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS conversion_job_items (
+            job_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            memory TEXT,
+            PRIMARY KEY (job_id, message_id)
+        );
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_conversion_jobs_status ON conversion_jobs (status);")
+
+    def create_job(self, job_id: str, uid: str, mode: str, message_ids: list = None, requested_count: int = None,
+                   force: bool = False):
+        now = time.time()
+        self.db.execute(
+            """
+            INSERT INTO conversion_jobs (job_id, uid, mode, status, requested_count, force, message_ids, total, created_at, updated_at)
+            VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?);
+            """,
+            (job_id, uid, mode, requested_count, int(force),
+             json.dumps(message_ids) if message_ids is not None else None,
+             len(message_ids) if message_ids is not None else 0, now, now)
+        )
+
+    def set_message_ids(self, job_id: str, message_ids: list):
+        self.db.execute(
+            "UPDATE conversion_jobs SET message_ids = ?, total = ?, updated_at = ? WHERE job_id = ?;",
+            (json.dumps(message_ids), len(message_ids), time.time(), job_id)
+        )
+
+    def set_status(self, job_id: str, status: str, error: str = None):
+        self.db.execute(
+            "UPDATE conversion_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?;",
+            (status, error, time.time(), job_id)
+        )
+
+    def get_job(self, job_id: str):
+        row = self.db.fetch_one("SELECT * FROM conversion_jobs WHERE job_id = ?;", (job_id,))
+        if not row:
+            return None
+
+        job = dict(row)
+        job["message_ids"] = json.loads(job["message_ids"]) if job["message_ids"] else None
+        return job
+
+    def get_unfinished_jobs(self) -> list:
+        rows = self.db.fetch_all("SELECT job_id FROM conversion_jobs WHERE status IN ('queued', 'running');") or []
+        return [row["job_id"] for row in rows]
+
+    def add_item(self, job_id: str, message_id: str, memory: str = None):
+        """Marks message_id as finished for the job; memory is None when the email produced no memory."""
+        self.db.execute(
+            "INSERT OR IGNORE INTO conversion_job_items (job_id, message_id, memory) VALUES (?, ?, ?);",
+            (job_id, message_id, memory)
+        )
+        self.db.execute(
+            """
+            UPDATE conversion_jobs SET
+                completed = (SELECT COUNT(*) FROM conversion_job_items WHERE job_id = ?),
+                delivered = (SELECT COUNT(memory) FROM conversion_job_items WHERE job_id = ?),
+                updated_at = ?
+            WHERE job_id = ?;
+            """,
+            (job_id, job_id, time.time(), job_id)
+        )
+
+    def get_completed_ids(self, job_id: str) -> set:
+        rows = self.db.fetch_all("SELECT message_id FROM conversion_job_items WHERE job_id = ?;", (job_id,)) or []
+        return {row["message_id"] for row in rows}
+
+    def get_memories(self, job_id: str) -> list:
+        rows = self.db.fetch_all(
+            "SELECT memory FROM conversion_job_items WHERE job_id = ? AND memory IS NOT NULL ORDER BY rowid;", (job_id,)
+        ) or []
+        return [row["memory"] for row in rows]
+
+
+class IMemoryLedgerRepository(ABC):
+    @abstractmethod
+    def get_converted(self, uid: str, message_ids: list) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def record(self, uid: str, message_id: str, memory: str = None):
+        raise NotImplementedError
+
+
+class MemoryLedgerRepository(IMemoryLedgerRepository):
+    """Every email already converted to a memory, per user, with the memory it produced."""
+
+    def __init__(self, db_manager: ISQLiteDatabaseManager):
+        self.db = db_manager
+        self.create_table()
+
+    def create_table(self):
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS memory_ledger (
+            uid TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            memory TEXT,
+            converted_at REAL NOT NULL,
+            PRIMARY KEY (uid, message_id)
+        );
+        """)
+
+    def get_converted(self, uid: str, message_ids: list) -> dict:
+        """{message_id: memory or None} for the given ids that were already converted."""
+        message_ids = list(dict.fromkeys(message_ids))
+        found = {}
+        for start in range(0, len(message_ids), 900):
+            chunk = message_ids[start:start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.db.fetch_all(
+                f"SELECT message_id, memory FROM memory_ledger WHERE uid = ? AND message_id IN ({placeholders});",
+                (uid, *chunk)
+            ) or []
+            for row in rows:
+                found[row["message_id"]] = row["memory"]
+        return found
+
+    def record(self, uid: str, message_id: str, memory: str = None):
+        """memory is None when the email produced no memory; it is still not converted again."""
+        self.db.execute(
+            """
+            INSERT INTO memory_ledger (uid, message_id, memory, converted_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(uid, message_id) DO UPDATE SET memory = excluded.memory, converted_at = excluded.converted_at;
+            """,
+            (uid, message_id, memory, time.time())
+        )
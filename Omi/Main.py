@@ -1,19 +1,24 @@
 import json
 import os
+import hmac
+import base64
 import pickle
 import logging
 import Logger
 import memory_converter
+from conversion_jobs import ConversionJobManager
 from Logger import LoggerType, FormatterType
-from email_service import GmailService
+from email_service import GmailService, gmail_service_registry, sync_state_repository
 from thread_manager import thread_manager
 from google_auth_oauthlib.flow import Flow
 from action_service import OmiActionService
 from new_emails_monitor import process_new_emails
+from prefilter_service import RuleBasedPreFilter
 from flask import Flask, request, redirect, session, render_template, jsonify
 from Database import SQLiteDatabaseManager, UserRepository
 from classification_service import AIClassificationService
-from Config import APP_SECRET_KEY, GOOGLE_CLIENT_SECRET, REDIRECT_URI, GMAIL_SCOPES, BASE_URI, ERROR_RESPONSES
+from Config import APP_SECRET_KEY, GOOGLE_CLIENT_SECRET, REDIRECT_URI, GMAIL_SCOPES, BASE_URI, ERROR_RESPONSES, \
+    GMAIL_PUSH_TOPIC, GMAIL_PUSH_TOKEN, PUSH_SAFETY_INTERVAL
 
 " -------------- SETUP -------------- "
 #region setup
@@ -26,6 +31,7 @@ flaskLogger.setLevel(logging.ERROR)
 db_manager = SQLiteDatabaseManager()
 user_repository = UserRepository(db_manager)
 classification_service = AIClassificationService()
+conversion_jobs = ConversionJobManager(thread_manager, lambda uid: get_gmail_service(uid))
 
 logger = Logger.Manager("Main", FormatterType.ADVANCED, LoggerType.CONSOLE)
 
@@ -98,22 +104,15 @@ def logout():
     if not uid:
         return ERROR_RESPONSES["NO_UID"]
 
-    # region Get Credentials
-    token_path = user_repository.get_credentials(uid)
-    if not token_path:
+    if not user_repository.get_credentials(uid):
         return ERROR_RESPONSES["NO_CREDENTIALS"]
 
-    with open(token_path, "rb") as token_file:
-        credentials = pickle.load(token_file)
-
-    if not credentials:
-        os.remove(token_path)
+    gmail_service = get_gmail_service(uid)
+    if not gmail_service:
         return ERROR_RESPONSES["NO_VALID_CREDENTIALS"]
-    # endregion
 
-    gmail_service = GmailService(credentials, thread_manager)
     gmail_service.stop_listening(uid)
-    # endregion
+    gmail_service_registry.remove(uid)
 
     user_repository.set_logged_in(uid, False)
 
@@ -139,7 +138,8 @@ def callback():
     if not uid:
         return ERROR_RESPONSES["NO_UID"]
 
-    start_listening_mail(uid, credentials)
+    gmail_service = gmail_service_registry.register(uid, credentials, thread_manager)
+    start_listening_mail(uid, gmail_service)
 
     # region Update database
     if not os.path.exists("tokens"):
@@ -181,6 +181,7 @@ def get_settings():
         "mail_count": settings["mail_count"],
         "important_categories": settings["important_categories"],
         "ignored_categories": settings["ignored_categories"],
+        "prefilter_rules": settings["prefilter_rules"],
     })
 
 
@@ -197,47 +198,46 @@ def update_settings():
     ignored_categories = data.get("ignored_categories")
 
     if not isinstance(mail_interval, int) or not isinstance(mail_count, int):
-        return ErrorResponses.INVALID_DATA
+        return ERROR_RESPONSES["INVALID_DATA"]
 
-    user = user_repository.get_user(uid)
+    prefilter_rules = data.get("prefilter_rules")
+    if prefilter_rules is not None and not RuleBasedPreFilter.is_valid_rules(prefilter_rules):
+        return ERROR_RESPONSES["INVALID_DATA"]
 
-    token_path = user["google_credentials"]
-
-    with open(token_path, "rb") as token_file:
-        credentials = pickle.load(token_file)
+    gmail_service = get_gmail_service(uid)
+    if not gmail_service:
+        return ERROR_RESPONSES["NO_VALID_CREDENTIALS"]
 
-    gmail_service = GmailService(credentials, thread_manager)
     gmail_service.stop_listening(uid)
 
     user_repository.update_user_settings(uid, mail_interval, mail_count, important_categories, ignored_categories)
+    if prefilter_rules is not None:
+        user_repository.update_prefilter_rules(uid, prefilter_rules)
 
-    start_listening_mail(uid, credentials)
+    start_listening_mail(uid, gmail_service)
 
     return jsonify({"status": "success"})
 
 @app.route("/get-email-subjects", methods=["GET"])
 def get_email_subjects():
     uid = request.args.get("uid")
-    offset = int(request.args.get("offset"))
+    cursor = request.args.get("cursor")
+    offset = int(request.args.get("offset", 0))
     limit = int(request.args.get("limit"))
 
     if not uid:
         return ERROR_RESPONSES["MISSING_UID"]
 
-    user = user_repository.get_user(uid)
-
-    token_path = user.get("google_credentials", None)
-
-    if not token_path:
+    gmail_service = get_gmail_service(uid)
+    if not gmail_service:
         return ERROR_RESPONSES["WENT_WRONG"]
 
-    with open(token_path, "rb") as token_file:
-        credentials = pickle.load(token_file)
-
-    gmail_service = GmailService(credentials, thread_manager)
-    subjects = gmail_service.fetch_email_subjects_paginated(offset, limit)
+    if cursor:
+        subjects, next_cursor = gmail_service.fetch_email_subjects_page(uid, cursor, limit)
+    else:
+        subjects, next_cursor = gmail_service.fetch_email_subjects_paginated(uid, offset, limit)
 
-    return jsonify({"subjects": subjects})
+    return jsonify({"subjects": subjects, "next_cursor": next_cursor})
 
 @app.route("/convert-to-memory", methods=["POST"])
 def convert_to_memories():
@@ -249,20 +249,24 @@ def convert_to_memories():
 
     data = request.get_json()
 
-    user = user_repository.get_user(uid)
-    token_path = user["google_credentials"]
-
-    with open(token_path, "rb") as token_file:
-        credentials = pickle.load(token_file)
+    gmail_service = get_gmail_service(uid)
+    if not gmail_service:
+        return ERROR_RESPONSES["NO_VALID_CREDENTIALS"]
 
     mode = data.get("mode", "count")
+    run_async = bool(data.get("async", False))
+    # convert again even emails that were already converted
+    force = bool(data.get("force", False))
 
     if mode == "count":
         mail_count = int(data.get("count", None))
         if not mail_count:
             return ERROR_RESPONSES["INVALID_MAIL_COUNT"]
-        memories = memory_converter.convert_with_email_count(uid, credentials, thread_manager, mail_count)
-        return jsonify({"memories": memories})
+        if run_async:
+            job_id = conversion_jobs.submit(uid, mode, email_count=mail_count, force=force)
+            return jsonify({"job_id": job_id, "status": "queued"}), 202
+        memories, timings = memory_converter.convert_with_email_count(uid, gmail_service, mail_count, force=force)
+        return jsonify({"memories": memories, "timings": timings})
 
     elif mode == "selection":
         selected_emails = data.get("selectedSubjects", [])
@@ -270,12 +274,88 @@ def convert_to_memories():
         if not selected_ids:
             return ERROR_RESPONSES["INVALID_DATA"]
 
-        memories = memory_converter.convert_with_selected_ids(uid, credentials, thread_manager, selected_ids)
-        return jsonify({"memories": memories})
+        if run_async:
+            job_id = conversion_jobs.submit(uid, mode, message_ids=selected_ids, force=force)
+            return jsonify({"job_id": job_id, "status": "queued"}), 202
+        memories, timings = memory_converter.convert_with_selected_ids(uid, gmail_service, selected_ids, force=force)
+        return jsonify({"memories": memories, "timings": timings})
 
     return ERROR_RESPONSES["INVALID_DATA"]
 
 
+@app.route("/convert-to-memory/<job_id>", methods=["GET"])
+def conversion_status(job_id: str):
+    uid = request.args.get("uid")
+    if not uid:
+        return ERROR_RESPONSES["NO_UID"]
+
+    status = conversion_jobs.get_status(job_id, uid)
+    if not status:
+        return ERROR_RESPONSES["JOB_NOT_FOUND"]
+
+    return jsonify(status)
+
+
+@app.route("/convert-to-memory/<job_id>/resume", methods=["POST"])
+def resume_conversion(job_id: str):
+    uid = request.args.get("uid")
+    if not uid:
+        return ERROR_RESPONSES["NO_UID"]
+
+    if not conversion_jobs.resume(job_id, uid):
+        return ERROR_RESPONSES["JOB_NOT_RESUMABLE"]
+
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+
+@app.route("/gmail-push", methods=["POST"])
+def gmail_push():
+    """
+    Receives Gmail change notifications, either as a Pub/Sub push envelope
+    ({"message": {"data": base64({"emailAddress", "historyId"})}}) or as a plain {"uid", "historyId"} body.
+    Push is only accepted with both GMAIL_PUSH_TOPIC and GMAIL_PUSH_TOKEN configured; anyone able
+    to reach the endpoint could otherwise wake any user's listener.
+    """
+    if not GMAIL_PUSH_TOPIC or not GMAIL_PUSH_TOKEN:
+        return ERROR_RESPONSES["PUSH_DISABLED"]
+    if not hmac.compare_digest(request.args.get("token", "").encode(), GMAIL_PUSH_TOKEN.encode()):
+        return ERROR_RESPONSES["INVALID_PUSH_TOKEN"]
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return ERROR_RESPONSES["INVALID_DATA"]
+
+    message = data.get("message")
+    if isinstance(message, dict) and message.get("data"):
+        try:
+            data = json.loads(base64.b64decode(message["data"]))
+        except (ValueError, TypeError):
+            return ERROR_RESPONSES["INVALID_DATA"]
+        if not isinstance(data, dict):
+            return ERROR_RESPONSES["INVALID_DATA"]
+
+    uid = data.get("uid")
+    email_address = data.get("emailAddress")
+    history_id = data.get("historyId")
+    if (uid is not None and not isinstance(uid, str)) or (email_address is not None and not isinstance(email_address, str)):
+        return ERROR_RESPONSES["INVALID_DATA"]
+    if history_id is not None and not str(history_id).isdecimal():
+        return ERROR_RESPONSES["INVALID_DATA"]
+
+    if not uid and email_address:
+        uid = sync_state_repository.get_uid_by_email(email_address)
+
+    # Always acknowledge, Pub/Sub redelivers anything that isn't a 2xx
+    if not uid:
+        return "", 204
+
+    gmail_service = get_gmail_service(uid)
+    if gmail_service and gmail_service.notify_change(uid, str(history_id) if history_id is not None else None):
+        logger.debug(f"Push notification for {uid} at history {history_id}")
+
+    return "", 204
+
+
 @app.route("/setup-complete")
 def is_setup_completed():
     uid = request.args.get("uid")
@@ -288,6 +368,18 @@ def is_setup_completed():
 #endregion
 
 
+def get_gmail_service(uid: str) -> GmailService:
+    def load_credentials():
+        token_path = user_repository.get_credentials(uid)
+        if not token_path or not os.path.exists(token_path):
+            return None
+
+        with open(token_path, "rb") as token_file:
+            return pickle.load(token_file)
+
+    return gmail_service_registry.get(uid, thread_manager, load_credentials)
+
+
 def start_listening_all_users():
     users = user_repository.get_all_users()
 
@@ -300,17 +392,15 @@ def start_listening_user(user):
         return
 
     uid = user["uid"]
-    token_path = user["google_credentials"]
-
-    with open(token_path, "rb") as token_file:
-        credentials = pickle.load(token_file)
-
-    start_listening_mail(uid, credentials)
+    gmail_service = get_gmail_service(uid)
+    if not gmail_service:
+        logger.warning(f"No valid credentials for {uid}, not listening")
+        return
 
+    start_listening_mail(uid, gmail_service)
 
-def start_listening_mail(uid: str, credentials: str):
-    gmail_service = GmailService(credentials, thread_manager)
 
+def start_listening_mail(uid: str, gmail_service: GmailService):
     if gmail_service.is_listening(uid):
         return
 
@@ -320,16 +410,22 @@ def start_listening_mail(uid: str, credentials: str):
     max_results = settings["mail_count"]
     important_categories = settings["important_categories"]
     ignored_categories = settings["ignored_categories"]
+    prefilter_rules = settings["prefilter_rules"]
+
+    if GMAIL_PUSH_TOPIC:
+        interval = max(interval, PUSH_SAFETY_INTERVAL)
 
     gmail_service.start_listening(
         uid,
-        callback=lambda emails: process_new_emails(uid, emails, important_categories, ignored_categories),
+        callback=lambda emails: process_new_emails(uid, emails, important_categories, ignored_categories, prefilter_rules),
         unread_only=False,
         interval=interval,
-        max_results=max_results
+        max_results=max_results,
+        push_topic=GMAIL_PUSH_TOPIC
     )
 
 
 if __name__ == '__main__':
     start_listening_all_users()
+    conversion_jobs.resume_interrupted()
     app.run(host='127.0.0.1', port=5000, debug=False, ssl_context="adhoc")
@@ -1,63 +1,196 @@
 import time
+import random
+import Logger
 import requests
+import threading
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone
-from Config import OMI_API_KEY, OMI_APP_ID
+from email.utils import parsedate_to_datetime
+from Logger import LoggerType, FormatterType
+from llm_executor import TokenBucket
+from Config import OMI_API_KEY, OMI_APP_ID, OMI_HTTP_POOL_SIZE, OMI_CONNECT_TIMEOUT, OMI_READ_TIMEOUT, \
+    OMI_RATE_INITIAL, OMI_RATE_MIN, OMI_RATE_MAX, OMI_RATE_INCREASE, OMI_MAX_RETRIES
+from parsed_email import ParsedEmail
+
+logger = Logger.Manager("action_service",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+
+def _create_session(pool_size: int = OMI_HTTP_POOL_SIZE) -> requests.Session:
+    """
+    A session whose connections to api.omi.me stay open between requests, so only the first
+    delivery per connection pays for the TCP and TLS handshake.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Shared by every OmiActionService and listener thread; Session only pools connections, all state is per request
+http_session = _create_session()
+
+
+class AdaptiveRateLimiter:
+    """
+    One token bucket per key. A key's rate grows additively while its responses stay healthy and
+    halves on a 429, whose Retry-After also pauses the key entirely.
+    """
+
+    def __init__(self, initial_rate: float = OMI_RATE_INITIAL, min_rate: float = OMI_RATE_MIN,
+                 max_rate: float = OMI_RATE_MAX, increase: float = OMI_RATE_INCREASE):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self._buckets = {}
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # capacity of a few requests, so an idle key can't burst far past its rate
+                bucket = TokenBucket(self.initial_rate, capacity=max(1.0, self.initial_rate / 60))
+                self._buckets[key] = bucket
+                self._rates[key] = self.initial_rate
+            return bucket
+
+    def acquire(self, key):
+        self._bucket(key).acquire(1)
+
+    def on_success(self, key):
+        bucket = self._bucket(key)
+        with self._lock:
+            rate = min(self.max_rate, self._rates[key] + self.increase)
+            changed = rate != self._rates[key]
+            self._rates[key] = rate
+        if changed:
+            bucket.set_rate(rate)
+
+    def on_throttled(self, key, retry_after: float = None):
+        bucket = self._bucket(key)
+        with self._lock:
+            rate = max(self.min_rate, self._rates[key] / 2)
+            self._rates[key] = rate
+        bucket.set_rate(rate)
+        if retry_after:
+            bucket.drain(retry_after)
+
+    def rate(self, key) -> float:
+        with self._lock:
+            return self._rates.get(key, self.initial_rate)
+
+
+# Shared by every OmiActionService, keyed by (app_id, uid)
+omi_rate_limiter = AdaptiveRateLimiter()
 
 
 class IActionService:
-    def send_memories(self, memories: list) -> bool:
+    def send_memories(self, memories: list) -> list:
         raise NotImplementedError
 
-    def send_email(self, email: dict, classification: dict) -> bool:
+    def send_email(self, email: ParsedEmail, classification: dict) -> bool:
         raise NotImplementedError
 
 class OmiActionService(IActionService):
-    def __init__(self, uid: str, language: str, api_key: str = OMI_API_KEY, app_id: str = OMI_APP_ID):
+    def __init__(self, uid: str, language: str, api_key: str = OMI_API_KEY, app_id: str = OMI_APP_ID,
+                 session: requests.Session = None, timeout: tuple = (OMI_CONNECT_TIMEOUT, OMI_READ_TIMEOUT),
+                 rate_limiter: AdaptiveRateLimiter = None, max_retries: int = OMI_MAX_RETRIES):
         self.uid = uid
         self.language = language
         self.api_key = api_key
         self.app_id = app_id
-
-    def send_memories(self, memories: list) -> bool:
-        url = f"https://api.omi.me/v2/integrations/{self.app_id}/user/memories?uid={self.uid}"
+        self.session = session or http_session
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or omi_rate_limiter
+        self.max_retries = max_retries
+
+    def _post(self, url: str, data: dict) -> tuple:
+        """
+        Posts under the (app, user) rate limit, retrying 429s, 5xx responses and connection errors
+        with jittered exponential backoff. Returns (success, status code, attempts).
+        """
+        key = (self.app_id, self.uid)
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
-        memory_count = 0
-
-        for memory in memories:
+        status_code = 500
+        for attempt in range(1, self.max_retries + 2):
+            self.rate_limiter.acquire(key)
+            retry_after = None
             try:
-                data = {
-                    "text": memory,
-                    "text_source": "other",
-                    "text_source_spec": f"learning from mails",
-                }
-
-                response = requests.post(url, headers=headers, json=data)
-                response.raise_for_status()
-                memory_count += 1
-                if response.status_code != 200:
-                    return False, response.status_code
+                response = self.session.post(url, headers=headers, json=data, timeout=self.timeout)
+                status_code = response.status_code
             except requests.exceptions.RequestException as e:
-                print(f"Error sending memory to Omi: {e}")
-                return False, 500
+                logger.warning(f"Error sending to Omi: {e}")
+                status_code = 500
+            else:
+                if response.ok:
+                    self.rate_limiter.on_success(key)
+                    return True, status_code, attempt
+                if status_code == 429:
+                    retry_after = self._retry_after(response)
+                    self.rate_limiter.on_throttled(key, retry_after)
+                elif status_code < 500:
+                    # the request itself is wrong, sending it again won't help
+                    return False, status_code, attempt
+
+            if attempt > self.max_retries:
+                break
+
+            delay = retry_after if retry_after is not None else min(30.0, 0.5 * 2 ** (attempt - 1)) * (0.5 + random.random())
+            logger.warning(f"Omi request failed ({status_code}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        return False, status_code, self.max_retries + 1
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def send_memories(self, memories: list) -> list:
+        """
+        Sends every memory, whatever happened to the ones before it.
+        Returns one {"memory", "success", "status_code", "attempts"} outcome per memory, in input order.
+        """
+        url = f"https://api.omi.me/v2/integrations/{self.app_id}/user/memories?uid={self.uid}"
+
+        outcomes = []
+        for memory in memories:
+            data = {
+                "text": memory,
+                "text_source": "other",
+                "text_source_spec": f"learning from mails",
+            }
 
-            # Adding a little bit rate Limiting
-            time.sleep(0.2)
+            success, status_code, attempts = self._post(url, data)
+            if not success:
+                logger.error(f"Error sending memory to Omi: HTTP {status_code}")
+            outcomes.append({"memory": memory, "success": success, "status_code": status_code, "attempts": attempts})
 
-        return True
+        return outcomes
 
-    def send_email(self, email: dict, classification: dict) -> bool:
+    def send_email(self, email: ParsedEmail, classification: dict) -> bool:
         url = f"https://api.omi.me/v2/integrations/{self.app_id}/user/conversations?uid={self.uid}"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
         text = self.compose_email_text(email, classification)
 
-        date = email.get('date', datetime.now(timezone.utc).isoformat())
+        date = email.date if email.timestamp else datetime.now(timezone.utc).isoformat()
         important = classification.get('important', None)
 
         data = {
@@ -67,19 +200,14 @@ class OmiActionService(IActionService):
             "text_source_spec": f"email about {important}" if important else "email",
             "language": self.language
         }
-        try:
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            return True, response.status_code
-        except requests.exceptions.RequestException as e:
-            print(f"Error sending email to Omi: {e}")
-            return False, 500
+        success, status_code, _ = self._post(url, data)
+        return success, status_code
 
     @staticmethod
-    def compose_email_text(email: dict, classification: dict) -> str:
-        subject = email.get('subject', '')
-        sender = email.get('from', '')
-        content = email.get('body', '')
+    def compose_email_text(email: ParsedEmail, classification: dict) -> str:
+        subject = email.subject
+        sender = email.sender
+        content = email.body
         important = classification.get('important', None)
         sender_importance = classification.get('sender_importance', '')
         priority = classification.get('priority', '')
@@ -1,13 +1,173 @@
 import os
 import json
+import hashlib
+import textwrap
+from functools import lru_cache
+from typing import NamedTuple
 import openai
-from Config import OPENAI_API_KEY
+import Logger
+from Logger import LoggerType, FormatterType
+from Config import OPENAI_API_KEY, CLASSIFICATION_BATCH_SIZE, CLASSIFICATION_BODY_TOKENS, SUMMARIZATION_BODY_TOKENS, \
+    SUMMARIZATION_BATCH_SIZE, SUMMARIZATION_BATCH_TOKENS
+from token_budget import fit_to_budget, count_tokens
 from action_service import OmiActionService
+from parsed_email import ParsedEmail
+from llm_executor import llm_executor, estimate_tokens
 import email_service
 
 
 GPT_MODEL = "gpt-4o-mini"
 
+logger = Logger.Manager("classification_service",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+
+CLASSIFICATION_PROPERTIES = {
+    "answer": {"type": "boolean", "description": "Set true if email clearly matches an IMPORTANT CATEGORY; otherwise false"},
+
+    "important": {"type": ["string", "null"],
+                  "description": "Identify exactly one matched IMPORTANT CATEGORY or Null if none match clearly."},
+
+    "priority": {"type": ["string", "null"], "description": """Determine based on urgency, sender's importance, deadlines, and the potential impact:
+    "high": Immediate action required, urgent issues, critical deadlines, security alerts.
+    "medium": Moderate urgency, needs attention soon (e.g., meetings, project updates).
+    "low": Minor urgency, informational updates, invoices with distant due dates.
+    null: If no clear priority."""},
+
+    "sender_importance": {"type": "string", "description": """Based on sender identity and context:
+    "critical": Important clients, management, executives, known critical contacts.
+    "regular": Known contacts, standard business emails.
+    "unknown": Unrecognized or new sender."""},
+
+    "summary": {"type": "string",
+                "description": "Provide a concise, single-sentence summary clearly capturing the core intent or action required."},
+
+    "sentiment": {"type": ["string", "null"], "description": """Analyze overall tone:
+    "positive": Clearly good news, approval, confirmations.
+    "neutral": Informational, factual, balanced.
+    "negative": Complaints, problems, urgent warnings or negative issues."""},
+
+    "has_attachment": {"type": "boolean",
+                       "description": "Set true if the email explicitly mentions or clearly indicates attachments; otherwise false."},
+
+    "has_links": {"type": "boolean", "description": "Set true if email clearly contains clickable URLs or mentions external links explicitly; otherwise false."},
+
+    "suggested_actions": {"type": "array", "items": {"type": "string"},
+                          "description": "Suggest relevant actions explicitly based on email content. Examples: [reply, schedule_meeting, pay_invoice, reset_password, review_document, follow_up, verify_account, check_security, track_shipping]"},
+
+    "tags": {"type": "array", "items": {"type": "string",
+                                        "description": "Include precise tags reflecting email context, content, industry, and keywords clearly relevant to help categorize effectively."}},
+
+    "reply_required": {"type": "boolean", "description": "Set true only if email explicitly requests a reply, confirmation, or clearly needs response; otherwise false."},
+
+    "language": {"type": "string",
+                 "description": "Use ISO 639-1 codes like 'tr' for Turkish, 'en' for English."},
+
+    "ignored": {"type": ["string", "null"],
+                "description": "Clearly identify exactly one IGNORED CATEGORY if the email matches any. If it also matches an IMPORTANT CATEGORY, IGNORED takes precedence."}
+}
+
+# Written from the email's own details, so never shared between users through the classification cache
+PERSONAL_FIELDS = ("summary", "tags", "suggested_actions")
+
+CLASSIFICATION_REQUIRED = ["answer", "important", "priority", "sender_importance", "summary", "sentiment",
+                           "has_attachment", "has_links", "suggested_actions", "tags", "reply_required",
+                           "language", "ignored"]
+
+
+@lru_cache(maxsize=2)
+def classification_tools(include_sender_importance: bool = True) -> tuple:
+    """
+    Returns (classify_email tool, classify_emails tool, required fields). Without sender_importance
+    the field is left out of the schema, for senders whose importance is already known locally.
+    """
+    properties = {key: value for key, value in CLASSIFICATION_PROPERTIES.items()
+                  if include_sender_importance or key != "sender_importance"}
+    required = [key for key in CLASSIFICATION_REQUIRED if key in properties]
+
+    single_tool = {
+        "type": "function",
+        "function": {
+            "name": "classify_email",
+            "description": "Record the classification of the email, following the system instructions.",
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": required
+            }
+        }
+    }
+
+    batch_tool = {
+        "type": "function",
+        "function": {
+            "name": "classify_emails",
+            "description": "Record the classification of every email, following the system instructions. "
+                           "Classify every email independently and return exactly one entry per email, tagged with its index.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "classifications": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "index": {"type": "integer", "description": "Index of the email, as given in its [Email N] marker."},
+                                **properties
+                            },
+                            "required": ["index"] + required
+                        }
+                    }
+                },
+                "required": ["classifications"]
+            }
+        }
+    }
+
+    return single_tool, batch_tool, required
+
+
+class CompiledClassifier(NamedTuple):
+    system_message: dict
+    single_tools: list
+    single_tool_choice: dict
+    batch_tools: list
+    batch_tool_choice: dict
+    required: list
+
+
+@lru_cache(maxsize=64)
+def compile_classifier(important_categories: tuple, ignored_categories: tuple, always_important: bool,
+                       include_sender_importance: bool = True) -> CompiledClassifier:
+    """
+    Builds the system prompt and tool schemas for one category configuration, once.
+    The tools don't depend on the categories, and every request for the same configuration sends
+    byte-identical tools + system message ahead of the email, which keeps them in the provider's prompt cache.
+    """
+    single_tool, batch_tool, required = classification_tools(include_sender_importance)
+
+    system_prompt = textwrap.dedent(f"""
+        You are an advanced email classifier. Analyze the given email thoroughly based on:
+
+        IMPORTANT CATEGORIES (exactly match the main purpose or intent): {', '.join(important_categories)}
+        IGNORED CATEGORIES (emails that are promotional, generic, or low priority): {', '.join(ignored_categories)}
+
+        If both important and ignored categories seem applicable, always prioritize {"IMPORTANT" if always_important else "IGNORED"}.
+        Return language using ISO 639-1 format
+        Determine priority and sender importance based on urgency, deadlines, or identity.
+        Make sure sentiment, tags, and suggested actions are accurate based on content.
+        """).strip()
+
+    return CompiledClassifier(
+        system_message={"role": "system", "content": system_prompt},
+        single_tools=[single_tool],
+        single_tool_choice={"type": "function", "function": {"name": "classify_email"}},
+        batch_tools=[batch_tool],
+        batch_tool_choice={"type": "function", "function": {"name": "classify_emails"}},
+        required=required
+    )
+
 
 class IClassificationService:
     def classify_emails(self, emails: list, important_categories: list, ignored_categories: list) -> list:
@@ -15,7 +175,10 @@ class IClassificationService:
 
 
 class ISummarizationService:
-    def summarize_email(self, email: dict) -> list:
+    def summarize_email(self, email: ParsedEmail, uid: str = None) -> list:
+        raise NotImplementedError
+
+    def summarize_emails(self, emails: list, uid: str = None) -> list:
         raise NotImplementedError
 
 
@@ -47,153 +210,344 @@ class AIClassificationService(IClassificationService):
         "greetings",
     ]
 
-    def __init__(self):
-        self.client = openai.Client(api_key=OPENAI_API_KEY)
+    def __init__(self, batch_size: int = CLASSIFICATION_BATCH_SIZE, cache=None):
+        """cache is an IClassificationCacheRepository; identical emails are then classified once across all users."""
+        # retries are owned by llm_executor
+        self.client = openai.Client(api_key=OPENAI_API_KEY, max_retries=0)
         self.always_important = False
+        self.batch_size = batch_size
+        self.cache = cache
 
-    def classify_emails(self, emails: list, important_categories=None, ignored_categories=None) -> list:
+    def classify_emails(self, emails: list, important_categories=None, ignored_categories=None, batch_size: int = None,
+                        uid: str = None) -> list:
+        """
+        Returns one classification per email, in input order. Emails are sent batch_size at a time
+        in a single request; emails missing or malformed in a batch answer are retried on their own.
+        Emails with a sender_hint take sender_importance from it and the model is not asked for it.
+        Results are cached only when uid is given.
+        """
         if ignored_categories is None:
-            ignored_categories = DEFAULT_IGNORED_CATEGORIES
+            ignored_categories = self.DEFAULT_IGNORED_CATEGORIES
         if important_categories is None:
-            important_categories = DEFAULT_IMPORTANT_CATEGORIES
-
-        classify_function = {
-            "type": "function",
-            "function": {
-                "name": "classify_email",
-                "description": (
-                    f"""
-
-                    You are an advanced email classifier. Analyze the given email thoroughly based on:
-
-                    IMPORTANT CATEGORIES (exactly match the main purpose or intent): {', '.join(important_categories)}
-                    IGNORED CATEGORIES (emails that are promotional, generic, or low priority): {', '.join(ignored_categories)}
-                    
-                    If both important and ignored categories seem applicable, always prioritize {"IMPORTANT" if self.always_important else "IGNORED"}.
-                    Return language using ISO 639-1 format
-                    Determine priority and sender importance based on urgency, deadlines, or identity.
-                    Make sure sentiment, tags, and suggested actions are accurate based on content.
-                    """
-                ),
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "answer": {"type": "boolean", "description": "Set true if email clearly matches an IMPORTANT CATEGORY; otherwise false"},
-
-                        "important": {"type": ["string", "null"],
-                                      "description": "Identify exactly one matched IMPORTANT CATEGORY or Null if none match clearly."},
-
-                        "priority": {"type": ["string", "null"], "description": """Determine based on urgency, sender's importance, deadlines, and the potential impact:
-                        "high": Immediate action required, urgent issues, critical deadlines, security alerts.
-                        "medium": Moderate urgency, needs attention soon (e.g., meetings, project updates).
-                        "low": Minor urgency, informational updates, invoices with distant due dates.
-                        null: If no clear priority."""},
-
-                        "sender_importance": {"type": "string", "description": """Based on sender identity and context:
-                        "critical": Important clients, management, executives, known critical contacts.
-                        "regular": Known contacts, standard business emails.
-                        "unknown": Unrecognized or new sender."""},
-
-                        "summary": {"type": "string",
-                                    "description": "Provide a concise, single-sentence summary clearly capturing the core intent or action required."},
-
-                        "sentiment": {"type": ["string", "null"], "description": """Analyze overall tone:
-                        "positive": Clearly good news, approval, confirmations.
-                        "neutral": Informational, factual, balanced.
-                        "negative": Complaints, problems, urgent warnings or negative issues."""},
-
-                        "has_attachment": {"type": "boolean",
-                                           "description": "Set true if the email explicitly mentions or clearly indicates attachments; otherwise false."},
-
-                        "has_links": {"type": "boolean", "description": "Set true if email clearly contains clickable URLs or mentions external links explicitly; otherwise false."},
-
-                        "suggested_actions": {"type": "array", "items": {"type": "string"},
-                                              "description": "Suggest relevant actions explicitly based on email content. Examples: [reply, schedule_meeting, pay_invoice, reset_password, review_document, follow_up, verify_account, check_security, track_shipping]"},
-
-                        "tags": {"type": "array", "items": {"type": "string",
-                                                            "description": "Include precise tags reflecting email context, content, industry, and keywords clearly relevant to help categorize effectively."}},
-
-                        "reply_required": {"type": "boolean", "description": "Set true only if email explicitly requests a reply, confirmation, or clearly needs response; otherwise false."},
-
-                        "language": {"type": "string",
-                                     "description": "Use ISO 639-1 codes like 'tr' for Turkish, 'en' for English."},
-
-                        "ignored": {"type": ["string", "null"],
-                                    "description": "Clearly identify exactly one IGNORED CATEGORY if the email matches any. If it also matches an IMPORTANT CATEGORY, IGNORED takes precedence."}
-                    },
-                    "required": ["answer", "important", "priority", "sender_importance", "summary", "sentiment",
-                                 "has_attachment", "has_links", "suggested_actions", "tags", "reply_required",
-                                 "language", "ignored"]
-                }
-            }
-        }
+            important_categories = self.DEFAULT_IMPORTANT_CATEGORIES
+        batch_size = max(1, batch_size or self.batch_size)
+
+        configuration = (tuple(important_categories), tuple(ignored_categories), self.always_important)
+        classifier = compile_classifier(*configuration)
+        known_sender_classifier = compile_classifier(*configuration, include_sender_importance=False)
+
+        configuration_hash = self._configuration_hash(important_categories, ignored_categories)
+        keys = [self._content_key(email) for email in emails]
+
+        # uid-scoped entries hold the whole classification, shared entries only the fields that
+        # can't carry one user's details (codes, amounts, links) over to another user
+        user_keys = {key: self._user_cache_key(configuration_hash, uid, key) for key in keys}
+        shared_keys = {key: f"{configuration_hash}:{key}" for key in keys}
+        cached = self.cache.get_many(list(user_keys.values()) + list(shared_keys.values())) if self.cache and uid else {}
+
+        known = {}
+        for key in keys:
+            if user_keys[key] in cached:
+                known[key] = cached[user_keys[key]]
+            elif shared_keys[key] in cached and not cached[shared_keys[key]].get("answer", False):
+                # not sent to Omi, so the per-user fields are never read
+                known[key] = {**cached[shared_keys[key]], "summary": "", "tags": [], "suggested_actions": []}
+
+        # identical emails inside one call are classified once as well
+        pending = {}
+        for email, key in zip(emails, keys):
+            if key not in known and key not in pending:
+                pending[key] = email
+
+        # emails from known senders use the smaller schema, so they are batched separately
+        jobs = []
+        for has_hint, job_classifier in ((False, classifier), (True, known_sender_classifier)):
+            group = [(key, email) for key, email in pending.items() if (email.sender_hint is not None) == has_hint]
+            for start in range(0, len(group), batch_size):
+                jobs.append((group[start:start + batch_size], job_classifier))
+
+        classified = {}
+        job_results = llm_executor.map(
+            lambda job: self._classify_chunk([email for _, email in job[0]], job[1], uid), jobs
+        )
+        for (chunk, _), chunk_results in zip(jobs, job_results):
+            for (key, _), result in zip(chunk, chunk_results):
+                classified[key] = result
+
+        if self.cache and uid and classified:
+            entries = {}
+            for key, result in classified.items():
+                entries[user_keys[key]] = result
+                entries[shared_keys[key]] = {field: value for field, value in result.items() if field not in PERSONAL_FIELDS}
+            self.cache.put_many(entries)
+
+        known.update(classified)
 
         results = []
+        for email, key in zip(emails, keys):
+            result = dict(known[key])
+            if email.sender_hint is not None:
+                result["sender_importance"] = email.sender_hint["sender_importance"]
+            else:
+                result.setdefault("sender_importance", "unknown")
+            results.append(result)
 
-        for email in emails:
-            subject = email.get('subject', '')
-            fromm = email.get('from', '')
-            content = email.get('body', '')
+        return results
 
-            prompt = (
-                f"Mail Title: {subject}\n"
-                f"From: {fromm}\n"
-                f"Content: {content[:1000]}"
-            )
+    def _configuration_hash(self, important_categories: list, ignored_categories: list) -> str:
+        configuration = json.dumps([sorted(important_categories), sorted(ignored_categories), self.always_important])
+        return hashlib.sha256(configuration.encode("utf-8")).hexdigest()[:16]
 
-            response = self.client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                tools=[classify_function],
-                tool_choice={"type": "function", "function": {"name": "classify_email"}}
-            )
+    def _content_key(self, email: ParsedEmail) -> str:
+        # exactly the text the model sees, so only emails it can't tell apart share a result
+        return hashlib.sha256(self._email_prompt(email).encode("utf-8")).hexdigest()
 
-            tool_call = response.choices[0].message.tool_calls[0]
-            arguments = tool_call.function.arguments
-            result = json.loads(arguments)
+    @staticmethod
+    def _user_cache_key(configuration_hash: str, uid: str, content_key: str) -> str:
+        uid_hash = hashlib.sha256(str(uid).encode("utf-8")).hexdigest()[:16]
+        return f"{configuration_hash}:{uid_hash}:{content_key}"
 
+    def _classify_chunk(self, chunk: list, classifier: CompiledClassifier, uid: str = None) -> list:
+        batch_results = {}
+        if len(chunk) > 1:
+            try:
+                batch_results = self._classify_batch(chunk, classifier, uid)
+            except Exception as e:
+                logger.warning(f"Batch classification failed, retrying {len(chunk)} emails one by one: {e}")
+
+        results = []
+        for index, email in enumerate(chunk):
+            result = batch_results.get(index)
+            if result is None:
+                result = self._classify_single(email, classifier, uid)
             results.append(result)
 
         return results
 
+    @staticmethod
+    def _email_prompt(email: ParsedEmail) -> str:
+        # decode generously, quotes and boilerplate are removed before the token budget is applied
+        body = fit_to_budget(email.body_preview(CLASSIFICATION_BODY_TOKENS * 16), CLASSIFICATION_BODY_TOKENS)
+        return (
+            f"Mail Title: {email.subject}\n"
+            f"From: {email.sender}\n"
+            f"Content: {body}"
+        )
+
+    def _classify_single(self, email: ParsedEmail, classifier: CompiledClassifier, uid: str = None) -> dict:
+        prompt = self._email_prompt(email)
+        response = llm_executor.call(
+            lambda: self.client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=[classifier.system_message, {"role": "user", "content": prompt}],
+                tools=classifier.single_tools,
+                tool_choice=classifier.single_tool_choice
+            ),
+            estimate_tokens(classifier.system_message["content"] + prompt),
+            uid=uid,
+            task="classify"
+        )
+
+        tool_call = response.choices[0].message.tool_calls[0]
+        return json.loads(tool_call.function.arguments)
+
+    def _classify_batch(self, emails: list, classifier: CompiledClassifier, uid: str = None) -> dict:
+        """Classifies several emails in one request; returns {position in emails: classification} for the valid answers."""
+        prompt = "\n\n".join(f"[Email {index}]\n{self._email_prompt(email)}" for index, email in enumerate(emails))
+
+        response = llm_executor.call(
+            lambda: self.client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=[classifier.system_message, {"role": "user", "content": prompt}],
+                tools=classifier.batch_tools,
+                tool_choice=classifier.batch_tool_choice
+            ),
+            estimate_tokens(classifier.system_message["content"] + prompt),
+            uid=uid,
+            task="classify"
+        )
+
+        tool_call = response.choices[0].message.tool_calls[0]
+        classifications = json.loads(tool_call.function.arguments).get("classifications", [])
+
+        results = {}
+        for item in classifications:
+            if not isinstance(item, dict):
+                continue
+            index = item.pop("index", None)
+            if not isinstance(index, int) or not 0 <= index < len(emails) or index in results:
+                continue
+            if any(key not in item for key in classifier.required):
+                continue
+            results[index] = item
+
+        return results
+
+
+SUMMARIZE_EMAILS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "record_memories",
+        "description": "Record the memories learned from the emails. Every email index must appear in exactly one entry.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "memories": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "indices": {"type": "array", "items": {"type": "integer"},
+                                        "description": "Indices of the emails this memory comes from, as given in their [Email N] markers. "
+                                                       "Several indices when the emails reveal the same thing."},
+                            "memory": {"type": "string"}
+                        },
+                        "required": ["indices", "memory"]
+                    }
+                }
+            },
+            "required": ["memories"]
+        }
+    }
+}
+
 
 class AISummarizationService(ISummarizationService):
-    def __init__(self):
-        self.client = openai.Client(api_key=OPENAI_API_KEY)
+    def __init__(self, batch_size: int = SUMMARIZATION_BATCH_SIZE, batch_tokens: int = SUMMARIZATION_BATCH_TOKENS):
+        # retries are owned by llm_executor
+        self.client = openai.Client(api_key=OPENAI_API_KEY, max_retries=0)
         self.always_important = False
         self.character_limit = 200
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
 
-    def summarize_email(self, email: dict) -> str:
-        system_prompt = f"""
+        self.system_prompt = f"""
         You are building long-term memory about the user from emails.
         Focus on what the email reveals about their behavior, relationships, or decisions.
         Output one paragraph of max {self.character_limit} chars, deeply user-centric.
         Avoid summaries. Be concise and insightful.
         Always act like you're building an evolving, personal profile to better serve and understand the user over time.
         """
+        self.batch_system_prompt = self.system_prompt + f"""
+        You are given several emails, each marked [Email N]. Write one memory per email.
+        When several emails reveal the same thing, write a single memory for all of them.
+        """
 
-        subject = email.get('subject', None)
-        content = email.get('body', None)
+    def _email_prompt(self, email: ParsedEmail):
+        subject = email.subject
+        content = fit_to_budget(email.body, SUMMARIZATION_BODY_TOKENS)
 
         if not subject or not content:
-            return []
+            return None
 
-        prompt = f"""
+        return f"""
             "Title": {subject},
             "Content": {content}
         """
 
-        response = self.client.chat.completions.create(
-            model=GPT_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ]
+    def _clip(self, summary: str) -> str:
+        summary = summary.strip()
+        if len(summary) > self.character_limit:
+            summary = summary[:self.character_limit] + "..."
+        return summary
+
+    def summarize_email(self, email: ParsedEmail, uid: str = None) -> str:
+        prompt = self._email_prompt(email)
+        if prompt is None:
+            return []
+
+        return self._summarize_prompt(prompt, uid)
+
+    def _summarize_prompt(self, prompt: str, uid: str = None) -> str:
+        response = llm_executor.call(
+            lambda: self.client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=[
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": prompt}
+                ]
+            ),
+            estimate_tokens(self.system_prompt + prompt),
+            uid=uid,
+            task="summarize"
         )
 
-        summary = response.choices[0].message.content.strip()
+        return self._clip(response.choices[0].message.content)
 
-        if len(summary) > self.character_limit:
-            summary = summary[:self.character_limit] + "..."
+    def summarize_emails(self, emails: list, uid: str = None) -> list:
+        """
+        Returns one memory per email in input order, "" for emails that produced none or whose memory
+        was merged into an earlier email's. Emails are packed into requests of at most batch_size emails
+        and batch_tokens prompt tokens, which run concurrently on llm_executor.
+        """
+        prompts = [self._email_prompt(email) for email in emails]
+
+        chunks = []
+        chunk, chunk_tokens = [], 0
+        for index, prompt in enumerate(prompts):
+            if prompt is None:
+                continue
+            tokens = count_tokens(prompt)
+            if chunk and (len(chunk) >= self.batch_size or chunk_tokens + tokens > self.batch_tokens):
+                chunks.append(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(index)
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append(chunk)
+
+        results = [""] * len(emails)
+        chunk_results = llm_executor.map(lambda indices: self._summarize_chunk([prompts[i] for i in indices], uid), chunks)
+        for indices, memories in zip(chunks, chunk_results):
+            for index, memory in zip(indices, memories):
+                results[index] = memory
 
-        return summary
+        return results
+
+    def _summarize_chunk(self, prompts: list, uid: str = None) -> list:
+        batch_results = {}
+        if len(prompts) > 1:
+            try:
+                batch_results = self._summarize_batch(prompts, uid)
+            except Exception as e:
+                logger.warning(f"Batch summarization failed, retrying {len(prompts)} emails one by one: {e}")
+
+        return [batch_results[index] if index in batch_results else self._summarize_prompt(prompt, uid)
+                for index, prompt in enumerate(prompts)]
+
+    def _summarize_batch(self, prompts: list, uid: str = None) -> dict:
+        """Summarizes several emails in one request; returns {position in prompts: memory} for the valid answers."""
+        prompt = "\n\n".join(f"[Email {index}]\n{email_prompt}" for index, email_prompt in enumerate(prompts))
+
+        response = llm_executor.call(
+            lambda: self.client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=[
+                    {"role": "system", "content": self.batch_system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                tools=[SUMMARIZE_EMAILS_TOOL],
+                tool_choice={"type": "function", "function": {"name": "record_memories"}}
+            ),
+            estimate_tokens(self.batch_system_prompt + prompt),
+            uid=uid,
+            task="summarize"
+        )
+
+        tool_call = response.choices[0].message.tool_calls[0]
+        entries = json.loads(tool_call.function.arguments).get("memories", [])
+
+        results = {}
+        for entry in entries:
+            if not isinstance(entry, dict) or not isinstance(entry.get("memory"), str) or not entry["memory"].strip():
+                continue
+            indices = [index for index in entry.get("indices") or []
+                       if isinstance(index, int) and 0 <= index < len(prompts) and index not in results]
+            if not indices:
+                continue
+            # a merged memory is delivered once, with the first of its emails
+            results[indices[0]] = self._clip(entry["memory"])
+            for index in indices[1:]:
+                results[index] = ""
+
+        return results
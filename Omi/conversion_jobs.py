@@ -0,0 +1,110 @@
+import uuid
+import Logger
+import memory_converter
+from Logger import LoggerType, FormatterType
+from thread_manager import IThreadManager
+from Config import CONVERSION_JOB_ATTEMPTS
+from Database import SQLiteDatabaseManager, ConversionJobRepository
+
+logger = Logger.Manager("conversion_jobs",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+
+class ConversionJobManager:
+    """
+    Runs /convert-to-memory conversions in the background. Job state and every finished email are
+    kept in SQLite, so a job interrupted by a restart resumes after its last finished email.
+    """
+
+    def __init__(self, thread_manager: IThreadManager, gmail_service_loader):
+        self.thread_manager = thread_manager
+        # uid -> GmailService or None
+        self.gmail_service_loader = gmail_service_loader
+        self.repository = ConversionJobRepository(SQLiteDatabaseManager())
+
+    def submit(self, uid: str, mode: str, email_count: int = None, message_ids: list = None, force: bool = False) -> str:
+        job_id = uuid.uuid4().hex
+        self.repository.create_job(job_id, uid, mode, message_ids, email_count, force)
+        self._start(job_id)
+        return job_id
+
+    def get_status(self, job_id: str, uid: str):
+        """Returns the job's progress and the memories delivered so far, or None for another user's job."""
+        job = self.repository.get_job(job_id)
+        if not job or job["uid"] != uid:
+            return None
+
+        return {
+            "job_id": job_id,
+            "status": job["status"],
+            "total": job["total"],
+            "completed": job["completed"],
+            "delivered": job["delivered"],
+            "error": job["error"],
+            "memories": self.repository.get_memories(job_id)
+        }
+
+    def resume(self, job_id: str, uid: str) -> bool:
+        """Runs a partial or failed job again for the emails it hasn't converted; False if it can't be resumed."""
+        job = self.repository.get_job(job_id)
+        if not job or job["uid"] != uid or job["status"] not in ("partial", "failed"):
+            return False
+
+        self.repository.set_status(job_id, "queued")
+        self._start(job_id)
+        return True
+
+    def resume_interrupted(self):
+        for job_id in self.repository.get_unfinished_jobs():
+            logger.info(f"Resuming conversion job {job_id}")
+            self._start(job_id)
+
+    def _start(self, job_id: str):
+        self.thread_manager.start_thread(f"conversion_job_{job_id}", self._run, (job_id,))
+
+    def _run(self, stop_event, job_id: str):
+        job = self.repository.get_job(job_id)
+        uid = job["uid"]
+
+        gmail_service = self.gmail_service_loader(uid)
+        if not gmail_service:
+            self.repository.set_status(job_id, "failed", "No valid credentials")
+            return
+
+        self.repository.set_status(job_id, "running")
+        try:
+            message_ids = job["message_ids"]
+            if message_ids is None:
+                # count jobs pin their emails on first run, so a resumed job converts the same ones
+                message_ids = gmail_service.api_client.list_message_ids(job["requested_count"])
+                self.repository.set_message_ids(job_id, message_ids)
+
+            remaining = self._remaining(job_id, message_ids)
+            for attempt in range(CONVERSION_JOB_ATTEMPTS):
+                if not remaining:
+                    break
+                if attempt:
+                    logger.info(f"Retrying {len(remaining)} unconverted emails of conversion job {job_id}")
+                memory_converter.convert_with_selected_ids(
+                    uid, gmail_service, remaining, force=bool(job["force"]),
+                    on_converted=lambda message_id, memory: self.repository.add_item(job_id, message_id, memory)
+                )
+                remaining = self._remaining(job_id, message_ids)
+        except Exception as e:
+            logger.error(f"Conversion job {job_id} failed: {e}")
+            self.repository.set_status(job_id, "failed", str(e))
+            return
+        finally:
+            self.thread_manager.stop_thread(f"conversion_job_{job_id}")
+
+        if remaining:
+            logger.warning(f"Conversion job {job_id} left {len(remaining)} of {len(message_ids)} emails unconverted")
+            self.repository.set_status(job_id, "partial", f"{len(remaining)} of {len(message_ids)} emails not converted")
+            return
+
+        self.repository.set_status(job_id, "completed")
+
+    def _remaining(self, job_id: str, message_ids: list) -> list:
+        completed = self.repository.get_completed_ids(job_id)
+        return [message_id for message_id in message_ids if message_id not in completed]
@@ -1,15 +1,24 @@
 import time
-import base64
+import threading
 import Logger
 import json
 import hashlib
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse, parse_qs
+from collections import Counter
+from ttl_cache import TTLCache
 from thread_manager import IThreadManager
 from Logger import LoggerType, FormatterType
 from datetime import timezone, datetime, timedelta
-from Database import SQLiteDatabaseManager, MailRepository
-from email.utils import parsedate_to_datetime
-from googleapiclient.discovery import build
+from Config import EMAIL_CACHE_MAX_BYTES, EMAIL_CACHE_TTL
+from parsed_email import ParsedEmail
+from sender_reputation import SenderReputationIndex
+from Database import SQLiteDatabaseManager, MailRepository, SyncStateRepository, EmailCacheRepository
+import httplib2
+import google_auth_httplib2
+from googleapiclient.http import HttpRequest
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 
 logger = Logger.Manager("gmail_service",
                         FormatterType.ADVANCED,
@@ -17,8 +26,73 @@ logger = Logger.Manager("gmail_service",
 
 db_manager = SQLiteDatabaseManager()
 gmail_repository = MailRepository(db_manager)
+sync_state_repository = SyncStateRepository(db_manager)
+email_cache = EmailCacheRepository(db_manager, EMAIL_CACHE_MAX_BYTES, EMAIL_CACHE_TTL)
+sender_reputation = SenderReputationIndex()
+
+# (uid, cursor, limit) -> (subjects, next_cursor)
+subject_page_cache = TTLCache(max_entries=512, ttl=120)
+# (uid, offset) -> cursor of the page starting at that offset
+subject_cursor_cache = TTLCache(max_entries=4096, ttl=600)
+
+
+class HistoryExpiredError(Exception):
+    pass
+
+
+def _is_message_gone(error) -> bool:
+    # deleted between the history listing and the fetch, retrying can't help
+    return isinstance(error, HttpError) and getattr(error.resp, "status", None) == 404
+
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+
+def _gmail_discovery_document():
+    """Parses the bundled Gmail discovery document once per process."""
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            document = get_static_doc("gmail", "v1")
+            if document:
+                _discovery_document = json.loads(document)
+        return _discovery_document
+
+
+def _build_gmail_service(credentials, on_content=None):
+    """on_content(format, size) is called with the payload size of every message response as it arrives."""
+    # httplib2 is not thread safe, so every thread talking to a shared client gets its own connection
+    local = threading.local()
+
+    def request_builder(http, postproc, uri, *args, **kwargs):
+        if not hasattr(local, "http"):
+            local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+
+        format = parse_qs(urlparse(uri).query).get("format")
+        if on_content is not None and format:
+            parse_response = postproc
+
+            # batched parts go through postproc too, so this sees each message's own payload
+            def postproc(response, content):
+                on_content(format[0], len(content))
+                return parse_response(response, content)
+
+        return HttpRequest(local.http, postproc, uri, *args, **kwargs)
+
+    document = _gmail_discovery_document()
+    if document is None:
+        return build("gmail", "v1", credentials=credentials, requestBuilder=request_builder)
+    return build_from_document(document, credentials=credentials, requestBuilder=request_builder)
+
 
 class IGmailAPIClient:
+    def list_message_ids(self, max_results: int, query: str = None) -> list:
+        raise NotImplementedError
+
+    def get_messages(self, message_ids: list) -> tuple:
+        raise NotImplementedError
+
     def fetch_messages(self, max_results: int):
         raise NotImplementedError
 
@@ -26,98 +100,239 @@ class IGmailAPIClient:
         raise NotImplementedError
 
 class GmailAPIClient(IGmailAPIClient):
-    def __init__(self, credentials):
-        self.service = build("gmail", "v1", credentials=credentials)
+    # Gmail accepts up to 100 calls per batch but starts rate limiting above ~50
+    BATCH_SIZE = 50
 
-    def fetch_messages_by_query(self, query: str, max_results: int = -1) -> list:
-        messages = []
-        page_token = None
+    # Headers read by the listing and pre-filtering code paths
+    METADATA_HEADERS = ["Date", "Subject", "From", "List-Unsubscribe"]
 
-        while True:
-            fetch_count = 500 if max_results < 0 else min(max_results - len(messages), 500)
+    # Partial-response masks: snippet, sizeEstimate, raw and attachment ids are never read, so never downloaded
+    FIELD_MASKS = {
+        "metadata": "id,threadId,labelIds,payload/headers",
+        "full": "id,threadId,labelIds,payload(mimeType,headers,body/data,parts)",
+    }
 
-            response = self.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=fetch_count,
-                pageToken=page_token
-            ).execute()
+    def __init__(self, credentials):
+        self.service = _build_gmail_service(credentials, on_content=self._count_bytes)
+        # Number of Gmail API calls by kind ("list", "get", "history", ...), batched gets count per message
+        self.call_counts = Counter()
+        # Downloaded message payload bytes by format
+        self.bytes_received = Counter()
+        self._counts_lock = threading.Lock()
+
+    def _count_call(self, kind: str, amount: int = 1):
+        with self._counts_lock:
+            self.call_counts[kind] += amount
+
+    def _count_bytes(self, format: str, size: int):
+        with self._counts_lock:
+            self.bytes_received[format] += size
+
+    def transfer_stats(self) -> dict:
+        with self._counts_lock:
+            gets = self.call_counts["get"]
+            total_bytes = sum(self.bytes_received.values())
+            return {
+                "calls": dict(self.call_counts),
+                "bytes": dict(self.bytes_received),
+                "bytes_per_message": total_bytes / gets if gets else 0.0
+            }
+
+    def get_messages(self, message_ids: list, format: str = "full", metadata_headers: list = None,
+                     fields: str = None) -> tuple:
+        """
+        Fetches the given messages through Gmail batch requests.
+        format="metadata" downloads headers only (METADATA_HEADERS unless metadata_headers is given),
+        format="full" the trimmed message including the MIME tree; fields overrides the partial-response mask.
+        Returns (messages, failures): messages in the same order as message_ids
+        (failed ones are left out) and a {message_id: error} dict for the failures.
+        """
+        if format == "metadata" and metadata_headers is None:
+            metadata_headers = self.METADATA_HEADERS
+        fields = fields or self.FIELD_MASKS.get(format)
+
+        results = {}
+        failures = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failures[request_id] = exception
+            else:
+                results[request_id] = response
+
+        for start in range(0, len(message_ids), self.BATCH_SIZE):
+            chunk = message_ids[start:start + self.BATCH_SIZE]
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for msg_id in chunk:
+                request = self.service.users().messages().get(
+                    userId="me",
+                    id=msg_id,
+                    format=format,
+                    metadataHeaders=metadata_headers,
+                    fields=fields
+                )
+                batch.add(request, request_id=msg_id)
+
+            self._count_call("batch")
+            self._count_call("get", len(chunk))
 
-            message_ids = response.get('messages', [])
-            if not message_ids:
-                break
+            try:
+                batch.execute()
+            except Exception as e:
+                for msg_id in chunk:
+                    if msg_id not in results:
+                        failures[msg_id] = e
+
+        for msg_id, error in failures.items():
+            logger.error(f"Error fetching message {msg_id}: {error}")
+
+        messages = [results[msg_id] for msg_id in message_ids if msg_id in results]
+        return messages, failures
+
+    def list_message_page(self, max_results: int, page_token: str = None, query: str = None) -> tuple:
+        """Returns (message_ids, next_page_token) for a single messages().list page of at most 500 ids."""
+        response = self.service.users().messages().list(
+            userId='me',
+            q=query,
+            maxResults=min(max_results, 500),
+            pageToken=page_token
+        ).execute()
+        self._count_call("list")
+
+        message_ids = [msg['id'] for msg in response.get('messages', [])]
+        return message_ids, response.get('nextPageToken')
+
+    def list_message_ids(self, max_results: int = 100, query: str = None) -> list:
+        """Lists message ids newest first; a negative max_results lists the whole mailbox."""
+        message_ids = []
+        page_token = None
 
-            for msg in message_ids:
-                msg_detail = self.service.users().messages().get(userId='me', id=msg['id']).execute()
-                messages.append(msg_detail)
+        while max_results < 0 or len(message_ids) < max_results:
+            fetch_count = 500 if max_results < 0 else max_results - len(message_ids)
 
-                if 0 <= max_results <= len(messages):
-                    return messages
+            page_ids, page_token = self.list_message_page(fetch_count, page_token, query)
+            if not page_ids:
+                break
+            message_ids.extend(page_ids)
 
-            page_token = response.get('nextPageToken')
             if not page_token:
                 break
 
-        return messages
+        return message_ids if max_results < 0 else message_ids[:max_results]
 
-    def fetch_messages(self, max_results: int = 100):
-        messages = []
+    def page_token_at(self, offset: int, query: str = None):
+        """Returns the page token of a listing that starts right after the newest offset messages."""
         page_token = None
+        skipped = 0
 
-        while len(messages) < max_results:
-            remaining = max_results - len(messages)
-            fetch_count = min(remaining, 500)
+        while skipped < offset:
+            page_ids, page_token = self.list_message_page(offset - skipped, page_token, query)
+            skipped += len(page_ids)
+            if not page_ids or not page_token:
+                return None
 
-            response = self.service.users().messages().list(
-                userId='me',
-                maxResults=fetch_count,
-                pageToken=page_token
-            ).execute()
+        return page_token
 
-            message_ids = response.get('messages', [])
-            if not message_ids:
-                break
+    def iter_message_ids(self, max_results: int = 100, query: str = None, page_size: int = 100):
+        """Yields lists of at most page_size message ids, newest first; a negative max_results walks the whole mailbox."""
+        listed = 0
+        page_token = None
+
+        while max_results < 0 or listed < max_results:
+            fetch_count = page_size if max_results < 0 else min(page_size, max_results - listed)
 
-            for msg in message_ids:
-                msg_detail = self.service.users().messages().get(userId='me', id=msg['id']).execute()
-                messages.append(msg_detail)
+            page_ids, page_token = self.list_message_page(fetch_count, page_token, query)
+            if not page_ids:
+                break
 
-                if len(messages) >= max_results:
-                    break
+            listed += len(page_ids)
+            yield page_ids
 
-            page_token = response.get('nextPageToken')
             if not page_token:
                 break
 
+    def fetch_messages_by_query(self, query: str, max_results: int = -1) -> list:
+        messages, _ = self.get_messages(self.list_message_ids(max_results, query))
+        return messages
+
+    def fetch_messages(self, max_results: int = 100):
+        messages, _ = self.get_messages(self.list_message_ids(max_results))
         return messages
 
     def fetch_unread_messages(self, max_results: int = 5):
         try:
             results = self.service.users().messages().list(userId="me", labelIds=["UNREAD"], maxResults=max_results).execute()
+            self._count_call("list")
             return results.get("messages", [])
         except Exception as e:
             logger.error(f"Error fetching emails: {e}")
             return []
 
-    def get_message(self, message_id: str):
-        return self.service.users().messages().get(userId="me", id=message_id).execute()
+    def get_message(self, message_id: str, format: str = "full"):
+        self._count_call("get")
+        response = self.service.users().messages().get(
+            userId="me",
+            id=message_id,
+            format=format,
+            metadataHeaders=self.METADATA_HEADERS if format == "metadata" else None,
+            fields=self.FIELD_MASKS.get(format)
+        ).execute()
+        return response
+
+    def get_profile(self) -> dict:
+        self._count_call("profile")
+        return self.service.users().getProfile(userId="me").execute()
+
+    def watch(self, topic_name: str) -> dict:
+        """Asks Gmail to publish mailbox changes to a Pub/Sub topic; returns {"historyId", "expiration"}."""
+        self._count_call("watch")
+        return self.service.users().watch(
+            userId="me",
+            body={"topicName": topic_name, "labelIds": ["INBOX"]}
+        ).execute()
+
+    def list_history(self, start_history_id: str) -> tuple:
+        """
+        Returns (message_ids, history_id): ids of the messages added since start_history_id,
+        oldest first, and the mailbox history id to resume from next time.
+        Raises HistoryExpiredError when Gmail no longer knows start_history_id.
+        """
+        message_ids = []
+        seen = set()
+        history_id = start_history_id
+        page_token = None
 
+        while True:
+            self._count_call("history")
+            try:
+                response = self.service.users().history().list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    pageToken=page_token
+                ).execute()
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(start_history_id) from e
+                raise
+
+            history_id = response.get("historyId", history_id)
+
+            for record in response.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    message = added.get("message", {})
+                    msg_id = message.get("id")
+                    labels = message.get("labelIds", [])
+                    if not msg_id or msg_id in seen or "SPAM" in labels or "TRASH" in labels:
+                        continue
+                    seen.add(msg_id)
+                    message_ids.append(msg_id)
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
 
-def decode_email_body(payload: dict) -> str:
-    decoded_parts = []
-    if "body" in payload and "data" in payload["body"]:
-        try:
-            decoded_parts.append(base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8"))
-        except Exception as e:
-            decoded_parts.append(f"[Error decoding body: {e}]")
-    if "parts" in payload:
-        for part in payload["parts"]:
-            if "body" in part and "data" in part["body"]:
-                try:
-                    decoded_parts.append(base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8"))
-                except Exception as e:
-                    decoded_parts.append(f"[Error decoding part: {e}]")
-    return "\n\n".join(decoded_parts) if decoded_parts else "[Content couldn't be read]"
+        return message_ids, history_id
 
 
 class GmailService:
@@ -126,99 +341,165 @@ class GmailService:
         self.api_client = GmailAPIClient(credentials)
         self.thread_manager = thread_manager
         self.last_seen_email_time = None
+        self._wake_events = {}
+        self._watch_expiration = 0
+
+    def update_credentials(self, uid: str, credentials):
+        """
+        Swaps in re-authorized credentials. A running listener keeps its thread and wake event
+        and uses the new client from its next fetch on.
+        """
+        self.credentials = credentials
+        self.api_client = GmailAPIClient(credentials)
+        # the user may have authorized another mailbox: watch it and resync from its own history cursor
+        self._watch_expiration = 0
+        sync_state_repository.clear_history_id(uid)
 
-    def fetch_email_subjects_paginated(self, offset: int, limit: int) -> list:
-        from googleapiclient.discovery import build
-        service = build('gmail', 'v1', credentials=self.credentials)
+        wake_event = self._wake_events.get(uid)
+        if wake_event:
+            wake_event.set()
 
-        result = service.users().messages().list(userId='me', maxResults=offset + limit, q="").execute()
-        messages = result.get('messages', [])
+    def fetch_email_subjects_page(self, uid: str, cursor: str, limit: int) -> tuple:
+        """Returns (subjects, next_cursor); cursor is the opaque value returned by the previous page or None."""
+        key = (uid, cursor, limit)
+        page = subject_page_cache.get(key)
+        if page is not None:
+            return page
 
-        subjects = []
-        for i in range(offset, offset + limit):
-            if i >= len(messages):
-                break
+        message_ids, next_cursor = self.api_client.list_message_page(limit, page_token=cursor)
 
-            msg_id = messages[i]['id']
-            msg = service.users().messages().get(userId='me', id=msg_id, format='metadata',
-                                                 metadataHeaders=["Subject"]).execute()
+        found = email_cache.get_subjects(uid, message_ids)
+        missing_ids = [msg_id for msg_id in message_ids if msg_id not in found]
+        messages, _ = self.api_client.get_messages(missing_ids, format="metadata", metadata_headers=["Subject"])
 
-            subject = "No Subject"
+        for msg in messages:
             headers = msg.get("payload", {}).get("headers", [])
-            for h in headers:
-                if h.get("name", "").lower() == "subject":
-                    subject = h["value"]
-                    break
+            found[msg["id"]] = next((h["value"] for h in headers if h.get("name", "").lower() == "subject"), "No Subject")
+
+        subjects = [{"id": msg_id, "subject": found[msg_id]} for msg_id in message_ids if msg_id in found]
+
+        page = (subjects, next_cursor)
+        subject_page_cache.set(key, page)
+        return page
+
+    def fetch_email_subjects_paginated(self, uid: str, offset: int, limit: int) -> tuple:
+        if offset <= 0:
+            cursor = None
+        else:
+            cursor = subject_cursor_cache.get((uid, offset))
+            if cursor is None:
+                cursor = self.api_client.page_token_at(offset)
+                if cursor is None:
+                    return [], None
 
-            subjects.append({
-                "id": msg_id,
-                "subject": subject
-            })
+        subjects, next_cursor = self.fetch_email_subjects_page(uid, cursor, limit)
+        if next_cursor:
+            subject_cursor_cache.set((uid, offset + limit), next_cursor)
 
-        return subjects
+        return subjects, next_cursor
 
     def fetch_all_emails(self, uid: str, max_results: int):
-        messages = self.api_client.fetch_messages(max_results)
+        message_ids = self.api_client.list_message_ids(max_results)
 
         return self._process_messages(
             uid,
-            messages,
+            message_ids,
             track_latest_time=False,
             mark_as_processed=False
         )
 
     def fetch_emails(self, uid: str, unread_only: bool = True, max_results: int = 5):
         if unread_only:
-            messages = self.api_client.fetch_unread_messages(max_results)
+            message_ids = [msg["id"] for msg in self.api_client.fetch_unread_messages(max_results)]
         else:
-            messages = self.api_client.fetch_messages(max_results)
+            message_ids = self.api_client.list_message_ids(max_results)
+
+        return self._process_messages(uid, message_ids)
+
+    def fetch_emails_incremental(self, uid: str, max_results: int = 5):
+        history_id = sync_state_repository.get_history_id(uid)
+        if history_id is None:
+            return self._resync(uid, max_results)
+
+        try:
+            message_ids, latest_history_id = self.api_client.list_history(history_id)
+        except HistoryExpiredError:
+            logger.warning(f"History cursor expired for {uid}, running a full resync")
+            sync_state_repository.clear_history_id(uid)
+            return self._resync(uid, max_results)
+
+        emails = []
+        failures = {}
+        if message_ids:
+            # history is oldest first while messages().list is newest first
+            emails = self._process_messages(uid, list(reversed(message_ids[-max_results:])), failures=failures)
+
+        # Move the cursor only once every added message is loaded; otherwise the same history is listed again
+        # next tick and the failed messages are retried (loaded ones are already marked processed)
+        retryable = [msg_id for msg_id, error in failures.items() if not _is_message_gone(error)]
+        if retryable:
+            logger.warning(f"Keeping the history cursor of {uid}, {len(retryable)} messages failed to load")
+        elif latest_history_id != history_id:
+            sync_state_repository.set_history_id(uid, latest_history_id)
+
+        return emails
+
+    def _resync(self, uid: str, max_results: int):
+        # Read the cursor before listing so mail arriving during the resync is picked up next tick
+        profile = self.api_client.get_profile()
+        history_id = profile.get("historyId")
+        if profile.get("emailAddress"):
+            sync_state_repository.set_email_address(uid, profile["emailAddress"])
+        emails = self.fetch_emails(uid, unread_only=False, max_results=max_results)
+        if history_id:
+            sync_state_repository.set_history_id(uid, history_id)
+        return emails
 
-        return self._process_messages(uid, messages)
+    def load_emails(self, uid: str, message_ids: list, failures: dict = None) -> list:
+        """
+        Returns the parsed emails in message_ids order, reading the local cache before Gmail.
+        Messages that couldn't be fetched are left out and, when failures is given, added to it with their error.
+        """
+        cached = email_cache.get_many(uid, message_ids)
+        missing_ids = [msg_id for msg_id in message_ids if msg_id not in cached]
+
+        mails, fetch_failures = self.api_client.get_messages(missing_ids)
+        if failures is not None:
+            failures.update(fetch_failures)
+        fetched = [ParsedEmail.from_message(mail) for mail in mails]
+        email_cache.put_many(uid, [email.to_dict() for email in fetched])
+
+        found = {msg_id: ParsedEmail.from_dict(data) for msg_id, data in cached.items()}
+        found.update((email.id, email) for email in fetched)
+        return [found[msg_id] for msg_id in message_ids if msg_id in found]
 
     def _process_messages(
             self,
             uid: str,
-            messages: list,
+            message_ids: list,
             track_latest_time: bool = True,
-            mark_as_processed: bool = True
+            mark_as_processed: bool = True,
+            failures: dict = None
     ):
-        emails = []
         latest_email_time = self.last_seen_email_time
 
-        for msg in reversed(messages):
-            msg_id = msg["id"]
-
-            if mark_as_processed and gmail_repository.is_email_processed(uid, msg_id):
-                continue
+        pending_ids = [
+            msg_id for msg_id in reversed(message_ids)
+            if not (mark_as_processed and gmail_repository.is_email_processed(uid, msg_id))
+        ]
+        emails = self.load_emails(uid, pending_ids, failures)
 
-            mail = self.api_client.get_message(msg_id)
-            payload = mail.get("payload", {})
-            headers = payload.get("headers", [])
+        for email in emails:
+            # headers only, so routing on the sender happens before any body is decoded
+            email.sender_hint = sender_reputation.lookup(uid, email.sender)
 
-            date = next((h["value"] for h in headers if h["name"].lower() == "date"), "No Date")
-            try:
-                date_obj = parsedate_to_datetime(date).astimezone(timezone.utc)
-                date_iso = date_obj.isoformat()
-            except Exception:
-                date_obj = None
-                date_iso = date
-
-            subject = next((h["value"] for h in headers if h["name"].lower() == "subject"), "No Subject")
-            from_email = next((h["value"] for h in headers if h["name"].lower() == "from"), "Unknown Sender")
-            body = decode_email_body(payload)
-
-            emails.append({
-                "date": date_iso,
-                "subject": subject,
-                "from": from_email,
-                "body": body,
-            })
-
-            if track_latest_time and date_obj and (latest_email_time is None or date_obj > latest_email_time):
-                latest_email_time = date_obj
+            if track_latest_time:
+                date_obj = email.timestamp
+                if date_obj and (latest_email_time is None or date_obj > latest_email_time):
+                    latest_email_time = date_obj
 
             if mark_as_processed:
-                gmail_repository.add_processed_email(uid, msg_id)
+                gmail_repository.add_processed_email(uid, email.id)
 
         if emails and track_latest_time:
             self.last_seen_email_time = latest_email_time
@@ -226,21 +507,137 @@ class GmailService:
         return emails
 
     def is_listening(self, uid: str) -> bool:
-        return self.thread_manager.is_thread_running(uid)
-
-    def start_listening(self, uid: str, callback, unread_only: bool = True, interval: int = 60, max_results: int = 5):
+        return bool(self.thread_manager.is_running(f"gmail_listener_{uid}"))
+
+    def start_listening(self, uid: str, callback, unread_only: bool = True, interval: int = 60, max_results: int = 5,
+                        incremental: bool = True, push_topic: str = None):
+        """
+        With push_topic set, Gmail publishes mailbox changes to that topic and notify_change()
+        triggers the fetch right away; interval is then only the safety poll.
+        """
+        self._wake_events.setdefault(uid, threading.Event())
         self.thread_manager.start_thread(
             thread_id=f"gmail_listener_{uid}",
             target_function=self._pool_emails,
-            args=(callback, uid, unread_only, interval, max_results)
+            args=(callback, uid, unread_only, interval, max_results, incremental, push_topic)
         )
 
     def stop_listening(self, uid: str):
         self.thread_manager.stop_thread(f"gmail_listener_{uid}")
+        wake_event = self._wake_events.get(uid)
+        if wake_event:
+            wake_event.set()
+
+    def notify_change(self, uid: str, history_id: str = None) -> bool:
+        """Wakes the listener of uid for an immediate incremental fetch; returns False if nothing needs fetching."""
+        wake_event = self._wake_events.get(uid)
+        if wake_event is None or not self.is_listening(uid):
+            return False
+
+        synced_history_id = sync_state_repository.get_history_id(uid)
+        # history ids are decimal strings; anything else can't be compared, so it just wakes the listener
+        if (history_id and synced_history_id and str(history_id).isdecimal() and str(synced_history_id).isdecimal()
+                and int(history_id) <= int(synced_history_id)):
+            return False
+
+        wake_event.set()
+        return True
+
+    def _renew_watch(self, uid: str, push_topic: str):
+        # Gmail watches expire after 7 days, renew a day early
+        if time.time() * 1000 < self._watch_expiration - 24 * 3600 * 1000:
+            return
+        try:
+            response = self.api_client.watch(push_topic)
+            self._watch_expiration = int(response.get("expiration", 0))
+
+            # notifications only carry the mailbox address, remember which uid it belongs to
+            email_address = self.api_client.get_profile().get("emailAddress")
+            if email_address:
+                sync_state_repository.set_email_address(uid, email_address)
+        except Exception as e:
+            logger.error(f"Error registering Gmail watch for {uid}: {e}")
 
-    def _pool_emails(self, stop_event, callback, uid, unread_only: bool, interval: int, max_results: int):
+    def _pool_emails(self, stop_event, callback, uid, unread_only: bool, interval: int, max_results: int,
+                     incremental: bool = True, push_topic: str = None):
+        wake_event = self._wake_events.setdefault(uid, threading.Event())
         while not stop_event.is_set():
-            emails = self.fetch_emails(uid, unread_only, max_results)
-            if emails:
-                callback(emails)
-            time.sleep(interval)
\ No newline at end of file
+            if push_topic:
+                self._renew_watch(uid, push_topic)
+
+            wake_event.clear()
+            try:
+                if incremental and not unread_only:
+                    emails = self.fetch_emails_incremental(uid, max_results)
+                else:
+                    emails = self.fetch_emails(uid, unread_only, max_results)
+                if emails:
+                    callback(emails)
+            except Exception as e:
+                # one bad round must not end the listener
+                logger.error(f"Error processing new emails for {uid}: {e}")
+
+            wake_event.wait(interval)
+
+
+class GmailServiceRegistry:
+    """
+    Keeps one GmailService (and its authorized API client) per uid so Flask routes
+    and listener threads share it instead of rebuilding the client on every call.
+    Services that are idle for idle_timeout seconds and not listening are dropped.
+    """
+
+    def __init__(self, idle_timeout: int = 30 * 60):
+        self.idle_timeout = idle_timeout
+        self._services = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def get(self, uid: str, thread_manager: IThreadManager, credentials_loader=None):
+        """Returns the cached service for uid, building it with credentials_loader() on a miss."""
+        with self._lock:
+            self._evict_idle()
+            service = self._services.get(uid)
+            if service is not None:
+                self._last_used[uid] = time.monotonic()
+                return service
+
+        credentials = credentials_loader() if credentials_loader else None
+        if not credentials:
+            return None
+
+        return self.register(uid, credentials, thread_manager)
+
+    def register(self, uid: str, credentials, thread_manager: IThreadManager) -> GmailService:
+        with self._lock:
+            service = self._services.get(uid)
+            if service is None:
+                service = GmailService(credentials, thread_manager)
+                self._services[uid] = service
+            elif not self._same_account(service.credentials, credentials):
+                # update in place, so a running listener and push notifications keep reaching the same service
+                service.update_credentials(uid, credentials)
+            self._last_used[uid] = time.monotonic()
+            return service
+
+    def remove(self, uid: str):
+        with self._lock:
+            self._services.pop(uid, None)
+            self._last_used.pop(uid, None)
+
+    @staticmethod
+    def _same_account(current, new) -> bool:
+        # Keep the existing client (and its refreshed access token) unless the user re-authorized
+        current_token = getattr(current, "refresh_token", None)
+        return current_token is not None and current_token == getattr(new, "refresh_token", None)
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for uid in [uid for uid, last_used in self._last_used.items() if last_used < deadline]:
+            if self._services[uid].is_listening(uid):
+                continue
+            self._services.pop(uid)
+            self._last_used.pop(uid)
+
+
+gmail_service_registry = GmailServiceRegistry()
@@ -0,0 +1,127 @@
+import time
+import random
+import openai
+import Logger
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from Logger import LoggerType, FormatterType
+from token_budget import count_tokens, token_usage_tracker
+from Config import LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE, LLM_MAX_RETRIES
+
+logger = Logger.Manager("llm_executor",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at rate_per_minute, holding at most capacity tokens."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate_per_minute: float):
+        with self._lock:
+            self._refill()
+            self.rate = rate_per_minute / 60.0
+
+    def drain(self, seconds: float):
+        """Empties the bucket so nothing is acquired for roughly the given number of seconds."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class LLMExecutor:
+    """
+    Runs model calls on a bounded thread pool under shared requests-per-minute and tokens-per-minute limits.
+    429s wait for Retry-After (or back off exponentially with jitter) and pause the whole pool, not just the caller.
+    """
+
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+    def __init__(self, max_workers: int = LLM_MAX_CONCURRENCY, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE, max_retries: int = LLM_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def call(self, request, estimated_tokens: int = 0, uid: str = None, task: str = None):
+        """
+        Runs request() on the calling thread once the rate limits allow it, retrying transient failures.
+        With a task set, the response's token usage is recorded for uid.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire(1)
+            if estimated_tokens:
+                self.token_bucket.acquire(estimated_tokens)
+
+            try:
+                response = request()
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+
+                delay = self._retry_after(e)
+                if delay is None:
+                    delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                if isinstance(e, openai.RateLimitError):
+                    self.request_bucket.drain(delay)
+                logger.warning(f"Model call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if task:
+                token_usage_tracker.record(uid, task, getattr(response, "usage", None))
+            return response
+
+    def map(self, function, items: list) -> list:
+        """Applies function to every item on the pool and returns the results in input order."""
+        if len(items) <= 1:
+            return [function(item) for item in items]
+
+        futures = [self.pool.submit(function, item) for item in items]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _retry_after(error):
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            return None
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    return count_tokens(text)
+
+
+llm_executor = LLMExecutor()
@@ -0,0 +1,254 @@
+import re
+import json
+import time
+import math
+import hashlib
+import random
+import Logger
+import threading
+from collections import Counter
+from email.utils import parseaddr
+from parsed_email import ParsedEmail
+from token_budget import clean_email_body
+from Logger import LoggerType, FormatterType
+from Database import SQLiteDatabaseManager, ClassificationLabelRepository
+from Config import LOCAL_CLASSIFIER_THRESHOLD, LOCAL_CLASSIFIER_MIN_SAMPLES, LOCAL_CLASSIFIER_RETRAIN_EVERY, \
+    LOCAL_CLASSIFIER_AUDIT_RATE, LOCAL_CLASSIFIER_RETRAIN_INTERVAL, LOCAL_CLASSIFIER_MIN_COMPARISONS
+
+logger = Logger.Manager("local_classifier",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+_WORD_PATTERN = re.compile(r"[^\W\d_]{2,}", re.UNICODE)
+
+def email_features(email: ParsedEmail) -> str:
+    """Text the local model learns from: sender address, subject and the cleaned start of the body."""
+    sender = parseaddr(email.sender)[1].lower()
+    return f"{sender}\n{email.subject}\n{clean_email_body(email.body_preview(2000))[:500]}"
+
+
+def tokenize(features: str) -> list:
+    sender, _, text = features.partition("\n")
+    tokens = [word.lower() for word in _WORD_PATTERN.findall(text)]
+    if sender:
+        # subject and sender words are weighted up, the sender address and domain are features on their own
+        tokens += [f"from:{sender}", f"domain:{sender.rpartition('@')[2]}"]
+        tokens += [f"subject:{word.lower()}" for word in _WORD_PATTERN.findall(text.partition("\n")[0])]
+    return tokens
+
+
+class NaiveBayesModel:
+    """Multinomial naive Bayes over token counts, predicting the classifier's boolean "answer"."""
+
+    def __init__(self):
+        self.class_counts = Counter()
+        self.token_counts = {True: Counter(), False: Counter()}
+        self.token_totals = Counter()
+        self.vocabulary = set()
+
+    def fit(self, samples: list) -> "NaiveBayesModel":
+        for tokens, label in samples:
+            self.class_counts[label] += 1
+            self.token_counts[label].update(tokens)
+            self.token_totals[label] += len(tokens)
+            self.vocabulary.update(tokens)
+        return self
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.class_counts.values())
+
+    def predict_proba(self, tokens: list) -> float:
+        """Probability that the email is important (answer=True)."""
+        total = self.sample_count
+        vocabulary_size = len(self.vocabulary) + 1
+        scores = {}
+        for label in (True, False):
+            # Laplace smoothing on both the prior and the token likelihoods
+            score = math.log((self.class_counts[label] + 1) / (total + 2))
+            denominator = self.token_totals[label] + vocabulary_size
+            for token in tokens:
+                score += math.log((self.token_counts[label][token] + 1) / denominator)
+            scores[label] = score
+
+        top = max(scores.values())
+        positive = math.exp(scores[True] - top)
+        negative = math.exp(scores[False] - top)
+        return positive / (positive + negative)
+
+
+def category_configuration(important_categories: list, ignored_categories: list) -> str:
+    """Short hash of a category configuration; labels are only comparable under the same one."""
+    configuration = json.dumps([sorted(important_categories), sorted(ignored_categories)])
+    return hashlib.sha256(configuration.encode("utf-8")).hexdigest()[:16]
+
+
+class LocalClassifierTier:
+    """
+    Learns from every model classification and answers the confident cases locally.
+    Models are per user and category configuration, since the labels only hold under the categories
+    they were produced with. Only confident "not important" answers are served locally: an important
+    email still needs the model's summary, priority and language before it can be delivered to Omi.
+    Naive Bayes is overconfident, so a model only answers once its confident predictions have agreed
+    with the model often enough; a small share of confident emails keeps being sent to measure that.
+    Training runs on a background thread, at most once per retrain_interval for each model.
+    """
+
+    def __init__(self, threshold: float = LOCAL_CLASSIFIER_THRESHOLD, min_samples: int = LOCAL_CLASSIFIER_MIN_SAMPLES,
+                 retrain_every: int = LOCAL_CLASSIFIER_RETRAIN_EVERY, audit_rate: float = LOCAL_CLASSIFIER_AUDIT_RATE,
+                 retrain_interval: float = LOCAL_CLASSIFIER_RETRAIN_INTERVAL,
+                 min_comparisons: int = LOCAL_CLASSIFIER_MIN_COMPARISONS):
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.retrain_every = retrain_every
+        self.audit_rate = audit_rate
+        self.retrain_interval = retrain_interval
+        self.min_comparisons = min_comparisons
+        self.label_repository = ClassificationLabelRepository(SQLiteDatabaseManager())
+        # (uid, configuration) -> model, None while there are too few labels
+        self._models = {}
+        self._new_labels = Counter()
+        self._trained_at = {}
+        self._training = set()
+        # (uid, configuration) -> [agreements, comparisons] of confident predictions against the model
+        self._confident_agreement = {}
+        self._lock = threading.Lock()
+
+        self.local_answers = 0
+        # confidence bucket (0.5, 0.6, ... 0.9) -> [agreements, comparisons] against the model
+        self.agreement = {}
+
+    def predict(self, uid: str, configuration: str, emails: list) -> list:
+        """Returns one (answer, confidence) pair per email, or None where no model is trained yet."""
+        model = self._model_for(uid, configuration)
+        if model is None:
+            return [None] * len(emails)
+
+        predictions = []
+        for email in emails:
+            probability = model.predict_proba(tokenize(email_features(email)))
+            answer = probability >= 0.5
+            predictions.append((answer, probability if answer else 1 - probability))
+        return predictions
+
+    def route(self, uid: str, configuration: str, emails: list) -> tuple:
+        """
+        Splits emails into local results and the ones that need the model.
+        Returns (decisions, predictions): decisions[i] is a classification dict when answered locally
+        and None otherwise; predictions are kept to score agreement once the model has answered.
+        """
+        predictions = self.predict(uid, configuration, emails)
+        trusted = self._is_trusted(uid, configuration)
+
+        decisions = []
+        for prediction in predictions:
+            if prediction is None or not trusted:
+                decisions.append(None)
+                continue
+
+            answer, confidence = prediction
+            if not answer and confidence >= self.threshold and random.random() >= self.audit_rate:
+                decisions.append({
+                    "answer": False,
+                    "important": None,
+                    "ignored": None,
+                    "local": True,
+                    "confidence": round(confidence, 4)
+                })
+            else:
+                decisions.append(None)
+
+        resolved = sum(1 for decision in decisions if decision is not None)
+        with self._lock:
+            self.local_answers += resolved
+        if resolved:
+            logger.info(f"Local classifier answered {resolved} of {len(emails)} emails for {uid}")
+
+        return decisions, predictions
+
+    def _is_trusted(self, uid: str, configuration: str) -> bool:
+        with self._lock:
+            agreed, compared = self._confident_agreement.get((uid, configuration), (0, 0))
+        return compared >= self.min_comparisons and agreed / compared >= self.threshold
+
+    def learn(self, uid: str, configuration: str, emails: list, classifications: list, predictions: list = None):
+        """Stores the model's labels as training data and scores the local predictions made for them."""
+        labels = []
+        for email, classification in zip(emails, classifications):
+            labels.append((
+                email.id,
+                email_features(email),
+                bool(classification.get("answer", False)),
+                classification.get("important"),
+                classification.get("ignored"),
+                classification.get("priority")
+            ))
+        self.label_repository.add_labels(uid, configuration, labels)
+
+        key = (uid, configuration)
+        with self._lock:
+            for prediction, classification in zip(predictions or [], classifications):
+                if prediction is None:
+                    continue
+                answer, confidence = prediction
+                agreed = answer == bool(classification.get("answer", False))
+                bucket = min(0.9, math.floor(confidence * 10) / 10)
+                counts = self.agreement.setdefault(bucket, [0, 0])
+                counts[0] += agreed
+                counts[1] += 1
+                if not answer and confidence >= self.threshold:
+                    confident = self._confident_agreement.setdefault(key, [0, 0])
+                    confident[0] += agreed
+                    confident[1] += 1
+
+            self._new_labels[key] += len(labels)
+
+    def _model_for(self, uid: str, configuration: str):
+        """The current model, if any; a retrain is started in the background when one is due."""
+        key = (uid, configuration)
+        with self._lock:
+            model = self._models.get(key)
+            stale = key not in self._models or self._new_labels[key] >= self.retrain_every
+            due = (stale and key not in self._training
+                   and time.monotonic() - self._trained_at.get(key, -self.retrain_interval) >= self.retrain_interval)
+            if due:
+                self._training.add(key)
+
+        if due:
+            threading.Thread(target=self._train, args=(key,), daemon=True, name=f"local_classifier_{uid}").start()
+        return model
+
+    def _train(self, key: tuple):
+        uid, configuration = key
+        try:
+            with self._lock:
+                new_labels = self._new_labels[key]
+
+            rows = self.label_repository.get_labels(uid, configuration)
+            model = None
+            if len(rows) >= self.min_samples and len({row["answer"] for row in rows}) == 2:
+                model = NaiveBayesModel().fit([(tokenize(row["features"]), bool(row["answer"])) for row in rows])
+                logger.info(f"Trained local classifier for {uid} on {len(rows)} labels")
+
+            with self._lock:
+                if model is not None or key not in self._models:
+                    self._models[key] = model
+                self._new_labels[key] -= new_labels
+        except Exception as e:
+            logger.error(f"Training the local classifier for {uid} failed: {e}")
+        finally:
+            with self._lock:
+                self._trained_at[key] = time.monotonic()
+                self._training.discard(key)
+    def stats(self) -> dict:
+        with self._lock:
+            compared = sum(counts[1] for counts in self.agreement.values())
+            agreed = sum(counts[0] for counts in self.agreement.values())
+            return {
+                "local_answers": self.local_answers,
+                "threshold": self.threshold,
+                "agreement_rate": agreed / compared if compared else None,
+                "agreement_by_confidence": {
+                    f"{bucket:.1f}": counts[0] / counts[1] for bucket, counts in sorted(self.agreement.items())
+                }
+            }
@@ -1,68 +1,91 @@
-import email_service
 from email_service import GmailService
+from pipeline import Pipeline, Stage
 from datetime import datetime, timezone
 from action_service import OmiActionService
-from email.utils import parsedate_to_datetime
 from classification_service import ISummarizationService, AISummarizationService
+from Database import SQLiteDatabaseManager, MemoryLedgerRepository
+from Config import STREAM_WINDOW_SIZE, MEMORY_SUMMARIZE_WORKERS, MEMORY_DELIVERY_WORKERS, MEMORY_PIPELINE_QUEUE_SIZE, \
+    SUMMARIZATION_BATCH_SIZE
 
 summarization_service: ISummarizationService = AISummarizationService()
+memory_ledger = MemoryLedgerRepository(SQLiteDatabaseManager())
 
 
-def convert_with_selected_ids(uid: str, credentials, thread_manager, selected_ids: list) -> list:
-    gmail_service = GmailService(credentials, thread_manager)
+def convert_with_selected_ids(uid: str, gmail_service: GmailService, selected_ids: list,
+                              window: int = STREAM_WINDOW_SIZE, on_converted=None, force: bool = False) -> tuple:
+    id_windows = (selected_ids[start:start + window] for start in range(0, len(selected_ids), window))
 
-    emails = []
-    for message_id in selected_ids:
-        mail = gmail_service.api_client.get_message(message_id)
+    return _send_to_memories(uid, gmail_service, id_windows, on_converted, force)
 
-        payload = mail.get("payload", {})
-        headers = payload.get("headers", [])
-
-        date = next((h["value"] for h in headers if h["name"].lower() == "date"), "No Date")
-        subject = next((h["value"] for h in headers if h["name"].lower() == "subject"), "No Subject")
-        from_email = next((h["value"] for h in headers if h["name"].lower() == "from"), "Unknown Sender")
-        body = email_service.decode_email_body(payload)
-
-        emails.append({
-            "date":  parsedate_to_datetime(date).astimezone(timezone.utc).isoformat(),
-            "subject": subject,
-            "from": from_email,
-            "body": body
-        })
-
-    return _send_to_memories(uid, emails)
-
-def convert_with_email_count(uid: str, credentials, thread_manager, email_count: int) -> list:
+def convert_with_email_count(uid: str, gmail_service: GmailService, email_count: int,
+                             window: int = STREAM_WINDOW_SIZE, force: bool = False) -> tuple:
     if email_count < 1:
-        return []
-
-    gmail_service = GmailService(credentials, thread_manager)
-    emails = gmail_service.fetch_all_emails(uid, email_count)
-
-    return _send_to_memories(uid, emails)
-
-def _send_to_memories(uid: str, memories: list) -> list:
-    results = _convert(memories)
+        return [], None
+
+    id_windows = gmail_service.api_client.iter_message_ids(email_count, page_size=window)
+
+    return _send_to_memories(uid, gmail_service, id_windows, force=force)
+
+def _send_to_memories(uid: str, gmail_service: GmailService, id_windows, on_converted=None, force: bool = False) -> tuple:
+    """
+    Fetches, summarizes and delivers emails as overlapping pipeline stages, so the first memory
+    reaches Omi as soon as its email is summarized. Returns (delivered memories, per-stage timings).
+    Emails in the memory ledger are skipped before they are fetched, unless force is set.
+    on_converted(message_id, memory or None) is called for every email that is finished with,
+    including skipped ones, which get the memory recorded in the ledger.
+    """
+    skipped = [0]
+
+    def email_batches():
+        for message_ids in id_windows:
+            if not force:
+                converted = memory_ledger.get_converted(uid, message_ids)
+                skipped[0] += len(converted)
+                if on_converted:
+                    # finished by an earlier conversion, with the memory it produced then
+                    for message_id, memory in converted.items():
+                        on_converted(message_id, memory)
+                message_ids = [message_id for message_id in message_ids if message_id not in converted]
+            # bodies are loaded one summarization request's worth at a time, so only queued batches hold any
+            for start in range(0, len(message_ids), SUMMARIZATION_BATCH_SIZE):
+                emails = gmail_service.load_emails(uid, message_ids[start:start + SUMMARIZATION_BATCH_SIZE])
+                if emails:
+                    yield emails
+
+    def finish(message_id: str, memory: str = None):
+        memory_ledger.record(uid, message_id, memory)
+        if on_converted:
+            on_converted(message_id, memory)
 
     # The language has been set to English for now.
     action_service = OmiActionService(uid, "en")
-    success = action_service.send_memories(results)
-
-    if not success:
-        return []
-
-    return results
-
-def _convert(emails) -> list:
-    results = []
-    for index in range(len(emails)):
-        email = emails[index]
-        result = summarization_service.summarize_email(email)
-        if not result:
-            continue
-        results.append(result)
 
-    return results
+    def summarize(emails):
+        summarized = []
+        for email, memory in zip(emails, summarization_service.summarize_emails(emails, uid)):
+            if memory:
+                summarized.append((email.id, memory))
+            else:
+                finish(email.id)
+        return summarized
+
+    def deliver(item):
+        message_id, memory = item
+        if not action_service.send_memories([memory])[0]["success"]:
+            return None
+        finish(message_id, memory)
+        return memory
+
+    pipeline = Pipeline([
+        # its queue holds batches, sized so at most MEMORY_PIPELINE_QUEUE_SIZE emails wait in it
+        Stage("summarize", summarize, MEMORY_SUMMARIZE_WORKERS, expand=True,
+              queue_size=max(1, MEMORY_PIPELINE_QUEUE_SIZE // SUMMARIZATION_BATCH_SIZE)),
+        Stage("deliver", deliver, MEMORY_DELIVERY_WORKERS)
+    ], queue_size=MEMORY_PIPELINE_QUEUE_SIZE)
+
+    memories, timings = pipeline.run(email_batches(), source_name="fetch")
+    timings["skipped"] = skipped[0]
+    return memories, timings
 
 
 def _parse_and_format_date(date_str: str) -> str:
@@ -70,4 +93,4 @@ def _parse_and_format_date(date_str: str) -> str:
         parsed = datetime.strptime(date_str, "%Y-%m-%d")
         return parsed.replace(tzinfo=timezone.utc).isoformat()
     except (ValueError, TypeError):
-        return None
\ No newline at end of file
+        return None
@@ -2,16 +2,44 @@ import Logger
 from Logger import FormatterType, LoggerType
 from action_service import OmiActionService
 from classification_service import AIClassificationService
+from prefilter_service import IPreFilterService, RuleBasedPreFilter
+from local_classifier import LocalClassifierTier, category_configuration
+from email_service import sender_reputation
+from Database import SQLiteDatabaseManager, ClassificationCacheRepository
 
 logger = Logger.Manager("Emails Monitor",
                         FormatterType.ADVANCED,
                         LoggerType.CONSOLE)
 
-classification_service = AIClassificationService()
+classification_cache = ClassificationCacheRepository(SQLiteDatabaseManager())
+classification_service = AIClassificationService(cache=classification_cache)
+prefilter_service: IPreFilterService = RuleBasedPreFilter()
+local_classifier = LocalClassifierTier()
 
 
-def process_new_emails(uid: str, emails: [], important_categories: [] = None, ignored_categories: [] = None):
-    classifications = classification_service.classify_emails(emails, important_categories, ignored_categories)
+def process_new_emails(uid: str, emails: [], important_categories: [] = None, ignored_categories: [] = None,
+                       prefilter_rules: dict = None):
+    if important_categories is None:
+        important_categories = AIClassificationService.DEFAULT_IMPORTANT_CATEGORIES
+    if ignored_categories is None:
+        ignored_categories = AIClassificationService.DEFAULT_IGNORED_CATEGORIES
+
+    # Pre-filtered emails are all ignored ones, only the ambiguous rest can end up in Omi
+    decisions = prefilter_service.prefilter(uid, emails, important_categories, ignored_categories, prefilter_rules)
+    emails = [email for email, decision in zip(emails, decisions) if decision is None]
+    if not emails:
+        return
+
+    configuration = category_configuration(important_categories, ignored_categories)
+    decisions, predictions = local_classifier.route(uid, configuration, emails)
+    predictions = [prediction for prediction, decision in zip(predictions, decisions) if decision is None]
+    emails = [email for email, decision in zip(emails, decisions) if decision is None]
+    if not emails:
+        return
+
+    classifications = classification_service.classify_emails(emails, important_categories, ignored_categories, uid=uid)
+    local_classifier.learn(uid, configuration, emails, classifications, predictions)
+    sender_reputation.record(uid, emails, classifications)
     for index in range(len(classifications)):
         email = emails[index]
         classification = classifications[index]
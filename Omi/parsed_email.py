@@ -0,0 +1,209 @@
+import re
+import base64
+import Logger
+from bs4 import BeautifulSoup
+from Config import MAX_BODY_CHARS
+from datetime import timezone, datetime
+from Logger import LoggerType, FormatterType
+from email.utils import parsedate_to_datetime
+
+logger = Logger.Manager("parsed_email",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+_CHARSET_PATTERN = re.compile(r'charset="?([^";\s]+)"?', re.IGNORECASE)
+# HTML markup is much longer than the text it renders to, decode more of it per budgeted character
+_HTML_EXPANSION = 8
+
+
+def _header(part: dict, name: str) -> str:
+    name = name.lower()
+    return next((h.get("value", "") for h in part.get("headers", []) if h.get("name", "").lower() == name), "")
+
+
+def _collect_text_parts(part: dict, plain_parts: list, html_parts: list):
+    mime_type = part.get("mimeType", "").lower()
+    filename = part.get("filename")
+    disposition = _header(part, "Content-Disposition").lower()
+
+    if filename or disposition.startswith("attachment"):
+        return
+
+    if mime_type.startswith("multipart/") or part.get("parts"):
+        for child in part.get("parts", []):
+            _collect_text_parts(child, plain_parts, html_parts)
+        return
+
+    if not part.get("body", {}).get("data"):
+        return
+
+    if mime_type == "text/html":
+        html_parts.append(part)
+    elif mime_type in ("text/plain", ""):
+        plain_parts.append(part)
+
+
+def _decode_part(part: dict, max_chars: int = None) -> str:
+    data = part["body"]["data"]
+    if max_chars is not None:
+        # 4 base64 characters carry 3 bytes and a UTF-8 character takes at most 4 bytes
+        data = data[:(max_chars * 4 * 4 // 3 + 4) // 4 * 4]
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+    match = _CHARSET_PATTERN.search(_header(part, "Content-Type"))
+    charset = match.group(1) if match else "utf-8"
+    try:
+        return raw.decode(charset, errors="replace" if max_chars is None else "ignore")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def decode_email_body(payload: dict, max_chars: int = None) -> str:
+    """
+    Walks the whole MIME tree and returns the text body, preferring text/plain parts and
+    converting text/html only when there is no plain text. Attachments are skipped and
+    decoding stops once max_chars characters have been produced.
+    """
+    plain_parts = []
+    html_parts = []
+    _collect_text_parts(payload, plain_parts, html_parts)
+
+    is_html = not plain_parts
+    decoded_parts = []
+    length = 0
+
+    for part in plain_parts or html_parts:
+        remaining = None if max_chars is None else max_chars - length
+        if remaining is not None and remaining <= 0:
+            break
+
+        try:
+            if is_html:
+                html = _decode_part(part, None if remaining is None else remaining * _HTML_EXPANSION)
+                text = BeautifulSoup(html, "html.parser").get_text("\n", strip=True)
+            else:
+                text = _decode_part(part, remaining)
+        except Exception as e:
+            logger.warning(f"Error decoding email part: {e}")
+            continue
+
+        if remaining is not None:
+            text = text[:remaining]
+        decoded_parts.append(text)
+        length += len(text) + 2
+
+    body = "\n\n".join(decoded_parts)
+    if max_chars is not None:
+        body = body[:max_chars]
+    return body if body.strip() else "[Content couldn't be read]"
+
+
+class ParsedEmail:
+    """
+    One Gmail message as the rest of the app sees it. Headers are indexed in a single pass,
+    the date is parsed and the body decoded only when first read.
+    """
+
+    __slots__ = ("id", "subject", "sender", "raw_date", "label_ids", "list_unsubscribe", "sender_hint",
+                 "_payload", "_body", "_date", "_timestamp")
+
+    _INDEXED_HEADERS = ("date", "subject", "from", "list-unsubscribe")
+
+    def __init__(self, message_id: str, subject: str = "No Subject", sender: str = "Unknown Sender",
+                 raw_date: str = "No Date", label_ids: tuple = (), list_unsubscribe: str = None,
+                 payload: dict = None, body: str = None):
+        self.id = message_id
+        self.subject = subject
+        self.sender = sender
+        self.raw_date = raw_date
+        self.label_ids = label_ids
+        self.list_unsubscribe = list_unsubscribe
+        # per-user sender reputation (see sender_reputation.SenderReputationIndex.lookup), set on ingest
+        self.sender_hint = None
+        self._payload = payload
+        self._body = body
+        self._date = None
+        self._timestamp = None
+
+    @classmethod
+    def from_message(cls, mail: dict) -> "ParsedEmail":
+        payload = mail.get("payload", {})
+
+        headers = {}
+        for header in payload.get("headers", []):
+            name = header.get("name", "").lower()
+            # keep the first occurrence like the old next(...) lookups did
+            if name in cls._INDEXED_HEADERS and name not in headers:
+                headers[name] = header.get("value", "")
+                if len(headers) == len(cls._INDEXED_HEADERS):
+                    break
+
+        return cls(
+            mail["id"],
+            subject=headers.get("subject", "No Subject"),
+            sender=headers.get("from", "Unknown Sender"),
+            raw_date=headers.get("date", "No Date"),
+            label_ids=tuple(mail.get("labelIds", ())),
+            list_unsubscribe=headers.get("list-unsubscribe"),
+            payload=payload
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ParsedEmail":
+        return cls(
+            data["id"],
+            subject=data.get("subject", "No Subject"),
+            sender=data.get("from", "Unknown Sender"),
+            raw_date=data.get("date", "No Date"),
+            label_ids=tuple(data.get("labels", ())),
+            list_unsubscribe=data.get("list_unsubscribe"),
+            # entries cached before bodies were decoded on write carry the MIME payload instead
+            payload=data.get("payload"),
+            body=data.get("body")
+        )
+
+    def to_dict(self) -> dict:
+        """Serializable form with the decoded body, so it is decoded once rather than on every read of the cache."""
+        return {
+            "id": self.id,
+            "date": self.date,
+            "subject": self.subject,
+            "from": self.sender,
+            "labels": list(self.label_ids),
+            "list_unsubscribe": self.list_unsubscribe,
+            "body": self.body
+        }
+
+    @property
+    def timestamp(self):
+        """Send time as an aware UTC datetime, or None when the Date header can't be parsed."""
+        if self._timestamp is None and self._date is None:
+            try:
+                self._timestamp = parsedate_to_datetime(self.raw_date).astimezone(timezone.utc)
+            except (TypeError, ValueError):
+                try:
+                    self._timestamp = datetime.fromisoformat(self.raw_date)
+                except ValueError:
+                    self._timestamp = None
+            self._date = self._timestamp.isoformat() if self._timestamp else self.raw_date
+        return self._timestamp
+
+    @property
+    def date(self) -> str:
+        """ISO 8601 UTC send time, or the raw Date header when it can't be parsed."""
+        if self._date is None:
+            self.timestamp
+        return self._date
+
+    @property
+    def body(self) -> str:
+        if self._body is None:
+            self._body = decode_email_body(self._payload or {}, MAX_BODY_CHARS)
+            self._payload = None
+        return self._body
+
+    def body_preview(self, max_chars: int) -> str:
+        """First max_chars characters of the body, decoding no more of the MIME tree than needed."""
+        if self._body is not None:
+            return self._body[:max_chars]
+        return decode_email_body(self._payload or {}, max_chars)
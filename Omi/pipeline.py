@@ -0,0 +1,164 @@
+import time
+import queue
+import Logger
+import threading
+from typing import Callable, Iterable, NamedTuple
+from Logger import LoggerType, FormatterType
+
+logger = Logger.Manager("pipeline",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    name: str
+    # item -> result, or None to drop the item
+    function: Callable
+    workers: int = 1
+    # the result is a list whose items are passed on one by one
+    expand: bool = False
+    # items allowed to wait for this stage, 0 for the pipeline's queue_size
+    queue_size: int = 0
+
+
+class _StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.first_output = None
+        self.last_output = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, produced: bool, failed: bool, elapsed: float):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += seconds
+            if failed:
+                self.errors += 1
+            elif not produced:
+                self.dropped += 1
+            else:
+                if self.first_output is None:
+                    self.first_output = elapsed
+                self.last_output = elapsed
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "first_output_seconds": None if self.first_output is None else round(self.first_output, 3),
+            "last_output_seconds": None if self.last_output is None else round(self.last_output, 3)
+        }
+
+
+class Pipeline:
+    """
+    Runs items from a source through stages connected by bounded queues, so every stage works
+    on earlier items while the previous one is still producing. A full queue blocks its producer,
+    which keeps at most queue_size items in flight between two stages.
+    """
+
+    def __init__(self, stages: list, queue_size: int = 25):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, source: Iterable, source_name: str = "source") -> tuple:
+        """Returns (outputs of the last stage in completion order, timings)."""
+        started_at = time.monotonic()
+        queues = [queue.Queue(maxsize=stage.queue_size or self.queue_size) for stage in self.stages]
+        queues.append(queue.Queue(maxsize=self.queue_size))
+        stats = [_StageStats(stage.name) for stage in self.stages]
+        source_stats = _StageStats(source_name)
+        source_error = []
+
+        def produce():
+            try:
+                iterator = iter(source)
+                while True:
+                    begin = time.monotonic()
+                    item = next(iterator, _DONE)
+                    end = time.monotonic()
+                    if item is _DONE:
+                        break
+                    source_stats.record(end - begin, True, False, end - started_at)
+                    queues[0].put(item)
+            except Exception as e:
+                logger.error(f"Pipeline source failed: {e}")
+                source_error.append(e)
+            finally:
+                queues[0].put(_DONE)
+
+        threads = [threading.Thread(target=produce, daemon=True, name="pipeline-source")]
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], queues[index + 1], stats[index], remaining, remaining_lock, started_at),
+                    daemon=True,
+                    name=f"pipeline-{stage.name}-{worker}"
+                ))
+
+        for thread in threads:
+            thread.start()
+
+        results = []
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            results.append(item)
+
+        for thread in threads:
+            thread.join()
+
+        timings = {
+            "total_seconds": round(time.monotonic() - started_at, 3),
+            "stages": [source_stats.to_dict()] + [stage_stats.to_dict() for stage_stats in stats]
+        }
+
+        if source_error:
+            raise source_error[0]
+
+        return results, timings
+
+    @staticmethod
+    def _work(stage: Stage, inbox: queue.Queue, outbox: queue.Queue, stats: _StageStats,
+              remaining: list, remaining_lock: threading.Lock, started_at: float):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                # let the stage's other workers see the end too; the last one passes it on
+                inbox.put(_DONE)
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    outbox.put(_DONE)
+                return
+
+            begin = time.monotonic()
+            result, failed = None, False
+            try:
+                result = stage.function(item)
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed: {e}")
+                failed = True
+            end = time.monotonic()
+
+            produced = bool(result) if stage.expand else result is not None
+            stats.record(end - begin, produced, failed, end - started_at)
+            if not produced:
+                continue
+            for output in (result if stage.expand else (result,)):
+                outbox.put(output)
@@ -0,0 +1,147 @@
+import Logger
+import threading
+from collections import Counter
+from email.utils import parseaddr
+from parsed_email import ParsedEmail
+from Logger import LoggerType, FormatterType
+
+logger = Logger.Manager("prefilter_service",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+
+class IPreFilterService:
+    def prefilter(self, uid: str, emails: list, important_categories: list, ignored_categories: list,
+                  rules: dict = None) -> list:
+        raise NotImplementedError
+
+
+class RuleBasedPreFilter(IPreFilterService):
+    """
+    Deterministic first pass in front of the classifier. Emails that are clearly in one of the
+    user's ignored categories get a classification without a model call; everything else is left to the model.
+    """
+
+    DEFAULT_RULES = {
+        "enabled": True,
+        # Gmail's own tabs and spam label
+        "use_labels": True,
+        # bulk mail carrying a List-Unsubscribe header counts as a newsletter
+        "use_list_unsubscribe": True,
+        # sender domains that are always ignored, e.g. ["mailchimp.com"]
+        "ignored_domains": [],
+        # addresses whose mail the model has consistently put in one ignored category and never answered
+        "use_sender_history": True,
+    }
+
+    # Highest share of a sender's past emails that were important and still lets it be ignored
+    SENDER_HISTORY_MAX_ANSWER_RATE = 0.05
+
+    LABEL_CATEGORIES = {
+        "SPAM": "spam",
+        "CATEGORY_PROMOTIONS": "promotion",
+        "CATEGORY_SOCIAL": "social media",
+    }
+
+    def __init__(self):
+        self.resolved = Counter()
+        self.seen = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def is_valid_rules(cls, rules) -> bool:
+        """Whether rules only sets known rules to values of their type: booleans, and a list of domain strings."""
+        if not isinstance(rules, dict):
+            return False
+        for name, value in rules.items():
+            if name not in cls.DEFAULT_RULES:
+                return False
+            if name == "ignored_domains":
+                if not isinstance(value, list) or not all(isinstance(domain, str) for domain in value):
+                    return False
+            elif not isinstance(value, bool):
+                return False
+        return True
+
+    @classmethod
+    def _merge_rules(cls, rules) -> dict:
+        # stored rules may predate validation, malformed values fall back to the defaults
+        merged = dict(cls.DEFAULT_RULES)
+        for name, value in (rules if isinstance(rules, dict) else {}).items():
+            if name == "ignored_domains" and isinstance(value, list):
+                merged[name] = [domain for domain in value if isinstance(domain, str)]
+            elif name in merged and name != "ignored_domains" and isinstance(value, bool):
+                merged[name] = value
+        return merged
+
+    def prefilter(self, uid: str, emails: list, important_categories: list, ignored_categories: list,
+                  rules: dict = None) -> list:
+        """Returns one entry per email: a classification dict for resolved emails, None for the ambiguous ones."""
+        rules = self._merge_rules(rules)
+        if not rules["enabled"]:
+            return [None] * len(emails)
+
+        ignored = {category.lower() for category in ignored_categories}
+        important = [category.lower() for category in important_categories]
+        ignored_domains = [domain.lower().lstrip("@") for domain in rules["ignored_domains"]]
+
+        decisions = [self._decide(email, important, ignored, ignored_domains, rules) for email in emails]
+
+        resolved = sum(1 for decision in decisions if decision is not None)
+        with self._lock:
+            self.seen[uid] += len(emails)
+            self.resolved[uid] += resolved
+        if resolved:
+            logger.info(f"Pre-filter resolved {resolved} of {len(emails)} emails without a model call for {uid}")
+
+        return decisions
+
+    def _decide(self, email: ParsedEmail, important: list, ignored: set, ignored_domains: list, rules: dict):
+        domain = parseaddr(email.sender)[1].lower().rpartition("@")[2]
+
+        if domain and any(domain == d or domain.endswith("." + d) for d in ignored_domains):
+            return self._ignored("sender domain", "ignored domain")
+
+        # anything that mentions an important category is the model's call, e.g. GitHub notifications carry List-Unsubscribe too
+        searchable = f"{email.subject} {email.sender}".lower()
+        if any(category in searchable for category in important):
+            return None
+
+        if rules["use_labels"]:
+            for label in email.label_ids:
+                category = self.LABEL_CATEGORIES.get(label)
+                if category in ignored:
+                    return self._ignored(category, f"label {label}")
+
+        if rules["use_list_unsubscribe"] and email.list_unsubscribe and "newsletter" in ignored:
+            return self._ignored("newsletter", "List-Unsubscribe header")
+
+        # only the address's own history: a new address at a known domain (e.g. a store's order mail) is the model's call
+        hint = email.sender_hint
+        if (rules["use_sender_history"] and hint is not None and hint["scope"] == "address"
+                and (hint["ignored"] or "").lower() in ignored and hint["answer_rate"] <= self.SENDER_HISTORY_MAX_ANSWER_RATE
+                and hint["sender_importance"] != "critical"):
+            return self._ignored(hint["ignored"], "sender history")
+
+        return None
+
+    @staticmethod
+    def _ignored(category: str, reason: str) -> dict:
+        return {
+            "answer": False,
+            "important": None,
+            "ignored": category,
+            "prefiltered": True,
+            "reason": reason
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            seen = sum(self.seen.values())
+            resolved = sum(self.resolved.values())
+            return {
+                "seen": seen,
+                "resolved": resolved,
+                "resolved_rate": resolved / seen if seen else 0.0,
+                "per_user": {uid: {"seen": self.seen[uid], "resolved": self.resolved[uid]} for uid in self.seen}
+            }
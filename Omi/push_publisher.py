@@ -0,0 +1,61 @@
+"""
+Local stand-in for the Gmail Pub/Sub push subscription.
+Posts watch-style change notifications to the /gmail-push endpoint, e.g.:
+
+    python push_publisher.py --email someone@gmail.com --history-id 123456
+    python push_publisher.py --uid some-uid --url http://127.0.0.1:5000/gmail-push --interval 5
+"""
+import json
+import time
+import base64
+import argparse
+import requests
+from Config import GMAIL_PUSH_TOKEN
+
+
+def build_envelope(email_address: str, history_id: int) -> dict:
+    data = json.dumps({"emailAddress": email_address, "historyId": history_id}).encode("utf-8")
+    return {
+        "message": {
+            "data": base64.b64encode(data).decode("ascii"),
+            "messageId": str(int(time.time() * 1000)),
+            "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        },
+        "subscription": "local-stand-in"
+    }
+
+
+def publish(url: str, body: dict) -> int:
+    params = {"token": GMAIL_PUSH_TOKEN}
+    # verify=False because the dev server runs with an adhoc certificate
+    response = requests.post(url, params=params, json=body, verify=False, timeout=10)
+    return response.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish Gmail change notifications to /gmail-push")
+    parser.add_argument("--url", default="https://127.0.0.1:5000/gmail-push")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--email", help="Mailbox address, sent as a Pub/Sub envelope")
+    target.add_argument("--uid", help="Omi uid, sent as a plain notification")
+    parser.add_argument("--history-id", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=0, help="Repeat every N seconds (0 sends once)")
+    args = parser.parse_args()
+    if not GMAIL_PUSH_TOKEN:
+        parser.error("GMAIL_PUSH_TOKEN must be set, /gmail-push rejects notifications without it")
+
+    while True:
+        if args.email:
+            body = build_envelope(args.email, args.history_id)
+        else:
+            body = {"uid": args.uid, "historyId": args.history_id}
+
+        print(f"Published notification: HTTP {publish(args.url, body)}")
+
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import time
+import Logger
+import threading
+from email.utils import parseaddr
+from Logger import LoggerType, FormatterType
+from Database import SQLiteDatabaseManager, SenderReputationRepository
+from Config import SENDER_HISTORY_SIZE, SENDER_HALF_LIFE_DAYS, SENDER_MIN_WEIGHT, SENDER_MIN_AGREEMENT
+
+logger = Logger.Manager("sender_reputation",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+# Domains shared by unrelated people, only the full address says something about the sender
+FREEMAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "live.com", "yahoo.com", "icloud.com",
+    "me.com", "aol.com", "proton.me", "protonmail.com", "yandex.com", "gmx.com", "mail.com"
+}
+
+
+def sender_keys(sender: str) -> list:
+    """Index keys for a From header: the normalized address, then its domain unless it is a freemail one."""
+    address = parseaddr(sender)[1].lower()
+    if not address:
+        return []
+
+    keys = [f"address:{address}"]
+    domain = address.rpartition("@")[2]
+    if domain and domain not in FREEMAIL_DOMAINS:
+        keys.append(f"domain:{domain}")
+    return keys
+
+
+class SenderReputationIndex:
+    """
+    Last SENDER_HISTORY_SIZE classifications per user and sender address / domain, decayed with a
+    SENDER_HALF_LIFE_DAYS half-life. A user's index is loaded into memory on first use, so lookups
+    are dict reads and can run before an email's body is decoded.
+    """
+
+    def __init__(self, history_size: int = SENDER_HISTORY_SIZE, half_life_days: float = SENDER_HALF_LIFE_DAYS,
+                 min_weight: float = SENDER_MIN_WEIGHT, min_agreement: float = SENDER_MIN_AGREEMENT,
+                 repository: SenderReputationRepository = None):
+        self.history_size = history_size
+        self.half_life = half_life_days * 24 * 3600
+        self.min_weight = min_weight
+        self.min_agreement = min_agreement
+        self.repository = repository or SenderReputationRepository(SQLiteDatabaseManager())
+        self._histories = {}
+        self._lock = threading.Lock()
+
+    def _user_index(self, uid: str) -> dict:
+        with self._lock:
+            index = self._histories.get(uid)
+        if index is None:
+            index = self.repository.get_histories(uid)
+            with self._lock:
+                index = self._histories.setdefault(uid, index)
+        return index
+
+    def lookup(self, uid: str, sender: str):
+        """
+        Returns {"sender_importance", "ignored", "answer_rate", "confidence", "scope"} when the sender's
+        past classifications agree enough to skip deriving them again, otherwise None.
+        scope is "address" when the address's own history decided, "domain" when its domain's did.
+        """
+        index = self._user_index(uid)
+        now = time.time()
+        for key in sender_keys(sender):
+            history = index.get(key)
+            if history:
+                hint = self._summarize(history, now)
+                if hint is not None:
+                    hint["scope"] = key.partition(":")[0]
+                    return hint
+        return None
+
+    def _summarize(self, history: list, now: float):
+        importance_weights = {}
+        ignored_weights = {}
+        answer_weight = 0.0
+        importance_total = 0.0
+        total = 0.0
+
+        for timestamp, sender_importance, ignored, answer in history:
+            weight = 0.5 ** ((now - timestamp) / self.half_life)
+            total += weight
+            answer_weight += weight if answer else 0.0
+            if sender_importance:
+                importance_total += weight
+                importance_weights[sender_importance] = importance_weights.get(sender_importance, 0.0) + weight
+            if ignored:
+                ignored_weights[ignored] = ignored_weights.get(ignored, 0.0) + weight
+
+        if total < self.min_weight or not importance_weights:
+            return None
+
+        sender_importance, importance_weight = max(importance_weights.items(), key=lambda item: item[1])
+        # entries filled from a hint have no sender_importance, agreement is measured on the others
+        confidence = importance_weight / importance_total
+        if confidence < self.min_agreement:
+            return None
+
+        # the ignored category the sender's mail consistently falls into, if any
+        ignored = None
+        if ignored_weights:
+            top_ignored, ignored_weight = max(ignored_weights.items(), key=lambda item: item[1])
+            if ignored_weight / total >= self.min_agreement:
+                ignored = top_ignored
+
+        return {
+            "sender_importance": sender_importance,
+            "ignored": ignored,
+            "answer_rate": answer_weight / total,
+            "confidence": confidence
+        }
+
+    def record(self, uid: str, emails: list, classifications: list):
+        """Adds the model's classifications of emails to the histories of their senders."""
+        index = self._user_index(uid)
+        now = time.time()
+        changed = {}
+
+        with self._lock:
+            for email, classification in zip(emails, classifications):
+                # sender_importance filled from a hint is not new evidence
+                sender_importance = None if email.sender_hint is not None else classification.get("sender_importance")
+                entry = [now, sender_importance, classification.get("ignored"), bool(classification.get("answer", False))]
+
+                for key in sender_keys(email.sender):
+                    history = index.setdefault(key, [])
+                    history.append(entry)
+                    while len(history) > self.history_size:
+                        # evict hint-filled entries before the classifications the hint rests on
+                        hinted = next((i for i, old in enumerate(history) if old[1] is None), 0)
+                        del history[hinted]
+                    changed[key] = history
+
+        self.repository.save_histories(uid, changed)
@@ -0,0 +1,58 @@
+import unittest
+from sender_reputation import SenderReputationIndex
+
+
+class _MemoryRepository:
+    def __init__(self):
+        self.histories = {}
+
+    def get_histories(self, uid: str) -> dict:
+        return {}
+
+    def save_histories(self, uid: str, histories: dict):
+        self.histories.update(histories)
+
+
+class _Email:
+    def __init__(self, sender: str):
+        self.sender = sender
+        self.sender_hint = None
+
+
+class SenderReputationIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SenderReputationIndex(history_size=20, half_life_days=30, min_weight=3, min_agreement=0.8,
+                                           repository=_MemoryRepository())
+
+    def _receive(self, sender: str, sender_importance: str) -> dict:
+        """Classifies one email the way GmailService does: the hint, if any, replaces the model's value."""
+        email = _Email(sender)
+        email.sender_hint = self.index.lookup("uid", email.sender)
+        if email.sender_hint is not None:
+            sender_importance = email.sender_hint["sender_importance"]
+        classification = {"sender_importance": sender_importance, "ignored": "Newsletter", "answer": False}
+        self.index.record("uid", [email], [classification])
+        return email.sender_hint
+
+    def test_hint_survives_for_consistent_sender(self):
+        sender = "News <news@example.org>"
+        hints = [self._receive(sender, "low") for _ in range(100)]
+
+        # a few classifications are needed before the history is trusted, after that it never lapses
+        first = next(i for i, hint in enumerate(hints) if hint is not None)
+        self.assertLessEqual(first, 5)
+        for hint in hints[first:]:
+            self.assertIsNotNone(hint)
+            self.assertEqual(hint["sender_importance"], "low")
+            self.assertEqual(hint["scope"], "address")
+
+    def test_no_hint_without_agreement(self):
+        sender = "Someone <someone@example.org>"
+        for sender_importance in ("low", "high", "low", "high"):
+            self.index.record("uid", [_Email(sender)], [{"sender_importance": sender_importance}])
+
+        self.assertIsNone(self.index.lookup("uid", sender))
+
+
+if __name__ == "__main__":
+    unittest.main()
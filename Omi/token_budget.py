@@ -0,0 +1,212 @@
+import re
+import Logger
+import threading
+from collections import Counter
+from Logger import LoggerType, FormatterType
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = Logger.Manager("token_budget",
+                        FormatterType.ADVANCED,
+                        LoggerType.CONSOLE)
+
+# Encoding used by the gpt-4o model family
+_ENCODING_NAME = "o200k_base"
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+# Used without tiktoken or when its encoding can't be loaded: ~4 characters per token for English text
+_CHARS_PER_TOKEN = 4
+
+_REPLY_HEADER_PATTERNS = [
+    re.compile(r"^On .{0,200}wrote:\s*$", re.IGNORECASE),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE),
+]
+# Outlook quotes replies under a separator and/or a From:/Sent: header block, forwards look the same
+_HEADER_BLOCK_START_PATTERN = re.compile(r"^(_{10,}|From:\s.+)$", re.IGNORECASE)
+_HEADER_LINE_PATTERN = re.compile(r"^(From|Sent|Date|To|Cc|Subject):\s*(.*)$", re.IGNORECASE)
+_FORWARD_SUBJECT_PATTERN = re.compile(r"^(fwd?|fw)\s*:", re.IGNORECASE)
+_FORWARD_MARKER_PATTERN = re.compile(r"^(-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)", re.IGNORECASE)
+_SIGNATURE_PATTERN = re.compile(r"^(-- ?|Sent from my .+|Get Outlook for .+)$", re.IGNORECASE)
+_BOILERPLATE_PATTERN = re.compile(
+    r"(unsubscribe|view (this email )?in (your )?browser|manage (your )?(email )?preferences|"
+    r"this email was sent to|privacy policy|all rights reserved|you are receiving this)",
+    re.IGNORECASE
+)
+# Longest trailing paragraph still treated as a footer
+_FOOTER_MAX_CHARS = 400
+
+
+def _get_encoding():
+    """Loads the encoding on first use; tiktoken may download it, so a failure falls back to the heuristic."""
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+
+    with _encoding_lock:
+        if not _encoding_loaded:
+            if tiktoken is not None:
+                try:
+                    _encoding = tiktoken.get_encoding(_ENCODING_NAME)
+                except Exception as e:
+                    logger.warning(f"Couldn't load the {_ENCODING_NAME} encoding, estimating token counts: {e}")
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * _CHARS_PER_TOKEN]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def _header_block(lines: list, start: int) -> dict:
+    """Header fields (lowercased names) of the block of "Name: value" lines starting at, or right after, start."""
+    fields = {}
+    index = start + 1 if lines[start].strip().startswith("_") else start
+    while index < len(lines):
+        match = _HEADER_LINE_PATTERN.match(lines[index].strip())
+        if not match:
+            break
+        fields.setdefault(match.group(1).lower(), match.group(2))
+        index += 1
+    return fields
+
+
+def _is_reply_header(lines: list, index: int) -> bool:
+    stripped = lines[index].strip()
+    if any(pattern.match(stripped) for pattern in _REPLY_HEADER_PATTERNS):
+        return True
+    if not _HEADER_BLOCK_START_PATTERN.match(stripped):
+        return False
+
+    # a quoted reply has From and Sent/Date; a forward keeps its body, which is the content
+    fields = _header_block(lines, index)
+    if _FORWARD_SUBJECT_PATTERN.match(fields.get("subject", "")):
+        return False
+    return "from" in fields and ("sent" in fields or "date" in fields)
+
+
+def _strip_footer(lines: list) -> list:
+    """Drops trailing paragraphs that are boilerplate (unsubscribe, privacy policy, ...), never the first one."""
+    paragraphs = []
+    for line in lines:
+        if not line:
+            paragraphs.append([])
+        elif paragraphs and paragraphs[-1]:
+            paragraphs[-1].append(line)
+        else:
+            paragraphs.append([line])
+    paragraphs = [paragraph for paragraph in paragraphs if paragraph]
+
+    while len(paragraphs) > 1:
+        footer = " ".join(paragraphs[-1])
+        if len(footer) > _FOOTER_MAX_CHARS or not _BOILERPLATE_PATTERN.search(footer):
+            break
+        paragraphs.pop()
+
+    return [line for paragraph in paragraphs for line in paragraph + [""]][:-1]
+
+
+def clean_email_body(text: str) -> str:
+    """
+    Drops quoted replies, the signature and a boilerplate footer, which carry no signal for the model.
+    Forwarded messages are kept, their body is usually what the email is about.
+    """
+    source = text.splitlines()
+    lines = []
+    in_forward = False
+    for index, line in enumerate(source):
+        stripped = line.strip()
+
+        if _FORWARD_MARKER_PATTERN.match(stripped):
+            in_forward = True
+        elif in_forward and _HEADER_LINE_PATTERN.match(stripped):
+            # the forwarded message's own From:/Date:/Subject: lines
+            pass
+        else:
+            if in_forward and stripped:
+                in_forward = False
+            # everything below a reply header or the signature delimiter is history or signature
+            if lines and (_is_reply_header(source, index) or _SIGNATURE_PATTERN.match(stripped)):
+                break
+        if stripped.startswith(">"):
+            continue
+        if not stripped and lines and not lines[-1]:
+            continue
+
+        lines.append(stripped)
+
+    cleaned = "\n".join(_strip_footer(lines)).strip()
+    # never hand the model an empty body because the whole email looked like quoting
+    return cleaned or text.strip()
+
+
+def fit_to_budget(text: str, max_tokens: int) -> str:
+    """Cleans the body first and only then truncates it to max_tokens."""
+    return truncate_to_tokens(clean_email_body(text), max_tokens)
+
+
+class TokenUsageTracker:
+    """Prompt and completion tokens per (uid, task); totals are kept in memory and per day in SQLite."""
+
+    def __init__(self):
+        self.prompt_tokens = Counter()
+        self.completion_tokens = Counter()
+        self.requests = Counter()
+        self._repository = None
+        self._lock = threading.Lock()
+
+    def _get_repository(self):
+        if self._repository is None:
+            # Database imports classification_service, which imports this module
+            from Database import SQLiteDatabaseManager, TokenUsageRepository
+            self._repository = TokenUsageRepository(SQLiteDatabaseManager())
+        return self._repository
+
+    def record(self, uid: str, task: str, usage):
+        if usage is None:
+            return
+
+        uid = uid or "unknown"
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+        with self._lock:
+            self.prompt_tokens[(uid, task)] += prompt_tokens
+            self.completion_tokens[(uid, task)] += completion_tokens
+            self.requests[(uid, task)] += 1
+
+        try:
+            self._get_repository().add_usage(uid, task, prompt_tokens, completion_tokens)
+        except Exception as e:
+            logger.error(f"Error recording token usage: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                f"{uid}/{task}": {
+                    "requests": self.requests[(uid, task)],
+                    "prompt_tokens": self.prompt_tokens[(uid, task)],
+                    "completion_tokens": self.completion_tokens[(uid, task)]
+                }
+                for uid, task in self.requests
+            }
+
+
+token_usage_tracker = TokenUsageTracker()